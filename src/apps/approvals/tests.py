@@ -1,3 +1,92 @@
+import datetime
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from djmoney.money import Money
+from ..employees.models import Employee, Rate
+from ..projects.models import Project
+from ..time_reports.models import APPROVED, SUBMITTED, TimeReport, ProjectRecord
 
-# Create your tests here.
+
+class ApprovalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_superuser('anna.nowak@example.com', first_name='Anna', last_name='Nowak')
+        cls.manager = Employee.objects.create(user=user)
+        cls.project = Project.objects.create(name='Alpha')
+        cls.project.managers.add(cls.manager)
+
+    def setUp(self):
+        self.client.force_login(self.manager.user)
+
+    def add_submitted_record(self, first_name, last_name, start_date=datetime.date(2023, 3, 1)):
+        user = User.objects.create_user(f'{first_name}.{last_name}@example.com'.lower(), first_name=first_name, last_name=last_name)
+        employee = Employee.objects.create(user=user)
+        Rate.objects.create(employee=employee, chargable=Money(100, 'PLN'), internal=Money(50, 'PLN'), start_date=datetime.date(2023, 1, 1))
+        time_report = TimeReport.objects.create(employee=employee, start_date=start_date)
+        project_record = ProjectRecord.objects.create(time_report=time_report, project=self.project, status=SUBMITTED)
+        project_record.set_hours_worked({1: 8, 2: 8})
+        return project_record
+
+
+class ApprovalDetailQueryTest(ApprovalsTestCase):
+    def test_approval_detail_query_count(self):
+        project_record = self.add_submitted_record('Jan', 'Kowalski')
+        with self.assertNumQueries(6):
+            response = self.client.get(project_record.get_detail_url())
+        self.assertEqual(response.status_code, 200)
+
+
+class ApprovalsListQueryTest(ApprovalsTestCase):
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('approvals:approval-list'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_approvals_list_query_count(self):
+        self.add_submitted_record('Jan', 'Kowalski')
+        queries = self.count_queries()
+        for first_name, last_name in [('Ewa', 'Lis'), ('Piotr', 'Zając'), ('Maria', 'Wójcik')]:
+            self.add_submitted_record(first_name, last_name)
+        self.assertEqual(self.count_queries(), queries)
+
+    def test_approvals_list_ordering(self):
+        second = self.add_submitted_record('Ewa', 'Lis', start_date=datetime.date(2023, 4, 1))
+        first = self.add_submitted_record('Jan', 'Kowalski', start_date=datetime.date(2023, 4, 1))
+        oldest = self.add_submitted_record('Piotr', 'Zając', start_date=datetime.date(2023, 3, 1))
+        response = self.client.get(reverse('approvals:approval-list'))
+        self.assertEqual(list(response.context['approvals']), [oldest, first, second])
+
+
+class ApprovalBulkDecisionTest(ApprovalsTestCase):
+    def test_bulk_approve(self):
+        project_records = [self.add_submitted_record(first_name, 'Kowalski') for first_name in ['Jan', 'Ewa', 'Piotr']]
+        response = self.client.post(reverse('approvals:approval-bulk-approve', kwargs={'type': 'project-time'}), {'approvals': [project_record.pk for project_record in project_records]})
+        self.assertRedirects(response, reverse('approvals:approval-list'))
+        for project_record in project_records:
+            project_record.refresh_from_db()
+            project_record.time_report.refresh_from_db()
+            self.assertEqual(project_record.status, APPROVED)
+            self.assertEqual(project_record.time_report.status, APPROVED)
+
+    def test_bulk_reject_requires_manager_of_all_items(self):
+        project_record = self.add_submitted_record('Jan', 'Kowalski')
+        other_record = self.add_submitted_record('Ewa', 'Lis')
+        other_record.project = Project.objects.create(name='Beta')
+        other_record.save()
+        self.client.post(reverse('approvals:approval-bulk-reject', kwargs={'type': 'project-time'}), {'approvals': [project_record.pk, other_record.pk]})
+        project_record.refresh_from_db()
+        self.assertEqual(project_record.status, SUBMITTED)
+
+    def test_bulk_reject_rolls_back_when_an_item_was_already_decided(self):
+        project_record = self.add_submitted_record('Jan', 'Kowalski')
+        decided_record = self.add_submitted_record('Ewa', 'Lis')
+        ProjectRecord.objects.filter(pk=decided_record.pk).update(status=APPROVED)
+        self.client.post(reverse('approvals:approval-bulk-reject', kwargs={'type': 'project-time'}), {'approvals': [project_record.pk, decided_record.pk]})
+        project_record.refresh_from_db()
+        decided_record.refresh_from_db()
+        self.assertEqual(project_record.status, SUBMITTED)
+        self.assertEqual(decided_record.status, APPROVED)
@@ -1,7 +1,8 @@
 from typing import Any
 from django import http
+from django.db import transaction
 from django.urls import reverse
-from ..time_reports.models import ProjectRecord
+from ..time_reports.models import APPROVED, REJECTED, SUBMITTED, ProjectRecord, TimeReport
 from django.views import generic, View
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
@@ -14,15 +15,18 @@ class ApprovalsList(PermissionRequiredMixin, SuccessMessageMixin, generic.ListVi
     context_object_name = 'approvals'
     permission_required = 'time_reports.view_time_report' # TODO: change permisssion to appropriate one
 
+    paginate_by = 50
+
     def get_queryset(self):
         current_user = self.request.user.employee
-        context = {}
-        context['time_reports'] = ProjectRecord.objects.filter(
-            status='submitted', #TODO: fix hardcoding
+        return ProjectRecord.objects.filter(
+            status=SUBMITTED,
             project__managers=current_user #TODO: fix relation name
-        ).order_by('project__name').order_by('time_report__employee__name').order_by('time_report__start_date')
-        # print (submitted_ProjectRecord)
-        return context
+        ).select_related(
+            'project', 'time_report__employee__user'
+        ).order_by(
+            'time_report__start_date', 'time_report__employee__user__last_name', 'time_report__employee__user__first_name', 'project__name', 'pk'
+        )
     
 class ApprovalDecision(PermissionRequiredMixin, SuccessMessageMixin, View):
     approval_item = None
@@ -62,6 +66,57 @@ class ApprovalDecision(PermissionRequiredMixin, SuccessMessageMixin, View):
         return redirect(self.approval_list_url)
 
 
+class ApprovalBulkDecision(PermissionRequiredMixin, SuccessMessageMixin, View):
+    http_method_names = ['post']
+    approval_item_type = None
+    approval_list_url = None
+
+    def has_permission(self) -> bool:
+        # manager permission for each item is checked in post, with one query for all of them
+        return hasattr(self.request.user, 'employee')
+
+    def setup(self, request, *args, **kwargs):
+        self.approval_list_url = reverse('approvals:approval-list')
+        return super().setup(request, *args, **kwargs)
+
+    def dispatch(self, request: http.HttpRequest, *args: Any, **kwargs: Any):    
+        if kwargs['type'] not in ['project-time']:
+            messages.error(request, format_html("Type <strong>{}</strong> not supported.", kwargs['type']))
+            return redirect(self.approval_list_url)
+        self.approval_item_type = 'Project'
+        return super().dispatch(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            approval_ids = {int(pk) for pk in request.POST.getlist('approvals')}
+        except ValueError:
+            approval_ids = None
+        if not approval_ids:
+            messages.error(request, "Nothing selected.")
+            return redirect(self.approval_list_url)
+
+        status = {'approve': APPROVED, 'reject': REJECTED}[kwargs['decision']]
+        with transaction.atomic():
+            # the guarded update only changes rows still submitted to this manager, so an item decided
+            # concurrently leaves the count short and the whole decision is rolled back
+            time_report_ids = set(ProjectRecord.objects.filter(pk__in=approval_ids).values_list('time_report_id', flat=True))
+            updated = ProjectRecord.objects.filter(
+                pk__in=approval_ids,
+                status=SUBMITTED,
+                project__managers=self.request.user.employee
+            ).update(status=status)
+            if updated != len(approval_ids):
+                transaction.set_rollback(True)
+                messages.error(request, "Some of the selected items are not submitted or you are not their manager. Nothing was changed.")
+                return redirect(self.approval_list_url)
+            TimeReport.objects.filter(pk__in=time_report_ids).update_status()
+
+        if status == APPROVED:
+            messages.success(request, format_html("{} items approved: <strong>{}</strong>.", self.approval_item_type, updated))
+        else:
+            messages.error(request, format_html("{} items rejected: <strong>{}</strong>.", self.approval_item_type, updated))
+        return redirect(self.approval_list_url)
+
 
 class ApprovalDetails(PermissionRequiredMixin, SuccessMessageMixin, View):
     # TODO: merge ApprovalDetails with ApprovalDecision
@@ -84,7 +139,7 @@ class ApprovalDetails(PermissionRequiredMixin, SuccessMessageMixin, View):
             messages.error(request, format_html("Type <strong>{}</strong> not supported.", kwargs['type']))
             return redirect(self.approval_list_url)
         if kwargs['type'] == 'project-time':
-            self.approval_item = get_object_or_404(ProjectRecord, id=kwargs['pk'])
+            self.approval_item = get_object_or_404(ProjectRecord.objects.select_related('project', 'time_report__employee__user'), id=kwargs['pk'])
             self.approval_item_type = 'Project'
             # self.context_object_name = 'project_time'
         if self.approval_item.status != 'submitted':
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from .models import permissions_cache
+
+
+class CachedPermissionsBackend(ModelBackend):
+    # ModelBackend with the permissions of a user cached across requests, until group or permission assignments
+    # change (see permissions_cache), when settings.PERMISSIONS_CACHE is on. Within a request they are kept
+    # on the user like ModelBackend does, so views, the perms of templates and sidebar_link load them at most once.
+    def get_all_permissions(self, user_obj, obj=None):
+        if not settings.PERMISSIONS_CACHE:
+            return super(CachedPermissionsBackend, self).get_all_permissions(user_obj, obj)
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            user_obj._perm_cache = permissions_cache.get_or_set(
+                user_obj.pk, lambda: super(CachedPermissionsBackend, self).get_all_permissions(user_obj))
+        return user_obj._perm_cache
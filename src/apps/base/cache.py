@@ -0,0 +1,120 @@
+import threading
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+class CacheNamespace:
+    # Group of cache entries sharing a version stored in the cache, bumping it invalidates all entries at once
+    # (also in other processes). Keys are single values or tuples, e.g. an employee id or (employee id, date).
+    namespaces = {}
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        CacheNamespace.namespaces[name] = self
+
+    def get_version(self):
+        version_key = f'{self.name}:version'
+        version = cache.get(version_key)
+        if version is None:
+            # start from the clock, so an evicted version never brings back old entries
+            cache.add(version_key, time.time_ns() // 1000, None)
+            version = cache.get(version_key)
+        return version
+
+    def make_key(self, key, version=None):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if version is None:
+            version = self.get_version()
+        return ':'.join([self.name, f'v{version}'] + [str(part) for part in key])
+
+    def record(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get(self, key):
+        value = cache.get(self.make_key(key))
+        self.record(value is not None, value is None)
+        return value
+
+    def get_many(self, keys) -> dict:
+        version = self.get_version()
+        cache_keys = {self.make_key(key, version): key for key in keys}
+        values = {cache_keys[cache_key]: value for cache_key, value in cache.get_many(cache_keys).items()}
+        self.record(len(values), len(cache_keys) - len(values))
+        return values
+
+    def set(self, key, value):
+        cache.set(self.make_key(key), value, self.timeout)
+
+    def set_many(self, values: dict):
+        version = self.get_version()
+        cache.set_many({self.make_key(key, version): value for key, value in values.items()}, self.timeout)
+
+    def get_or_set(self, key, default):
+        # default is a callable, only called on a miss
+        value = self.get(key)
+        if value is None:
+            value = default()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        cache.delete(self.make_key(key))
+
+    def invalidate(self):
+        version_key = f'{self.name}:version'
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            cache.add(version_key, time.time_ns() // 1000, None)
+
+    def invalidate_on(self, sender, key=None, fields=None):
+        # Invalidate on save/delete of the sender, or on changes of an m2m through model (always the whole namespace).
+        # key(instance) selects a single entry to delete instead of the whole namespace,
+        # fields skips saves with update_fields not touching any of them (e.g. last_login on login).
+        # Inside a transaction it is done again after the commit, as other requests still read the old rows
+        # until then and may have cached them in between.
+        def invalidate(cache_key, using):
+            action = self.invalidate if cache_key is None else lambda: self.delete(cache_key)
+            if transaction.get_connection(using).in_atomic_block:
+                action()
+            transaction.on_commit(action, using=using)
+
+        def on_save(instance, using, update_fields=None, **kwargs):
+            if fields is not None and update_fields is not None and not set(update_fields) & set(fields):
+                return
+            on_delete(instance, using)
+
+        def on_delete(instance, using, **kwargs):
+            invalidate(None if key is None else key(instance), using)
+
+        def on_m2m_change(action, using, **kwargs):
+            if action in ('post_add', 'post_remove', 'post_clear'):
+                invalidate(None, using)
+
+        if sender._meta.auto_created:
+            m2m_changed.connect(on_m2m_change, sender=sender, weak=False)
+            return
+        post_save.connect(on_save, sender=sender, weak=False)
+        post_delete.connect(on_delete, sender=sender, weak=False)
+
+    def get_stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / requests, 3) if requests else None,
+        }
+
+
+def get_cache_stats() -> dict:
+    # hit/miss counters of this process, per namespace
+    return {name: namespace.get_stats() for name, namespace in sorted(CacheNamespace.namespaces.items())}
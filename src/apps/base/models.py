@@ -1,14 +1,43 @@
-from django.utils.crypto import get_random_string
+from django.contrib.auth.models import Group, Permission, User
+from django.db import IntegrityError, transaction
 from slugify import slugify
+from .cache import CacheNamespace
+
+# permissions of users, see backends.py, kept shortly as a missed invalidation leaves revoked permissions
+permissions_cache = CacheNamespace('auth:permissions', 60)
 
 def unique_slugify(instance, string_to_slugify, restricted_slugs=[]):
-    slug_value = slugify(string_to_slugify)
+    # first free slug of "name", "name-2", "name-3", ... found with a single query
     model = instance.__class__
+    max_length = model._meta.get_field('slug').max_length
+    # room left for the suffix
+    slug_value = slugify(string_to_slugify, max_length=max_length - 6)
     hardcoded_restricted_slugs = ['add', 'exec', 'all', 'api']
-    
-    restricted_slugs = restricted_slugs + hardcoded_restricted_slugs
-    if slug_value in restricted_slugs:
-        slug_value = slug_value + get_random_string(length=4)
-    if model.objects.filter(slug=slug_value).exists():
-        slug_value = unique_slugify(instance,  slug_value + get_random_string(length=4))
-    return slug_value
\ No newline at end of file
+
+    taken = set(restricted_slugs + hardcoded_restricted_slugs)
+    taken.update(model.objects.filter(slug__startswith=slug_value).exclude(pk=instance.pk).values_list('slug', flat=True))
+    if slug_value not in taken:
+        return slug_value
+    suffix = 2
+    while f'{slug_value}-{suffix}' in taken:
+        suffix += 1
+    return f'{slug_value}-{suffix}'
+
+def save_with_unique_slug(instance, string_to_slugify, save, attempts=3):
+    # save() with a new unique slug, when a concurrent save took the slug meanwhile the next free one is used
+    for attempt in range(attempts):
+        instance.slug = unique_slugify(instance, string_to_slugify)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            slug_taken = instance.__class__.objects.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not slug_taken or attempt == attempts - 1:
+                raise
+
+permissions_cache.invalidate_on(Permission)
+permissions_cache.invalidate_on(Group)
+permissions_cache.invalidate_on(Group.permissions.through)
+permissions_cache.invalidate_on(User.groups.through)
+permissions_cache.invalidate_on(User.user_permissions.through)
+permissions_cache.invalidate_on(User, key=lambda user: user.pk, fields=['is_active', 'is_superuser'])
@@ -0,0 +1,85 @@
+import base64
+import json
+from functools import reduce
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class SortedListMixin:
+    # ListView mixin for long lists. ?sort=<column> (or -<column>) orders by the fields of one of sort_columns,
+    # which should be backed by an index, with the primary key breaking ties. Pages are either numbered
+    # (?page=n, counting the rows) or continue after the last row of the previous page (?after=<cursor>),
+    # a keyset page the database finds by seeking the index instead of skipping OFFSET rows, so deep pages
+    # stay as fast as the first one. Next page links always use the cursor.
+    sort_columns = {}
+    default_sort = None
+    paginate_by = 50
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', self.default_sort)
+        if sort.lstrip('-') not in self.sort_columns:
+            return self.default_sort
+        return sort
+
+    def get_ordering(self):
+        sort = self.get_sort()
+        prefix = '-' if sort.startswith('-') else ''
+        return [prefix + field for field in self.sort_columns[sort.lstrip('-')] + ('pk',)]
+
+    def get_keyset_filter(self, values):
+        # rows after values in the ordering, (a, b) > (x, y) being a > x or a = x and b > y
+        ordering = self.get_ordering()
+        keyset_filter = Q()
+        for i, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{field.lstrip("-")}__{lookup}': values[i]})
+            for previous, value in zip(ordering[:i], values):
+                condition &= Q(**{previous.lstrip('-'): value})
+            keyset_filter |= condition
+        return keyset_filter
+
+    def encode_cursor(self, row):
+        values = [reduce(getattr, field.lstrip('-').split('__'), row) for field in self.get_ordering()]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except ValueError:
+            raise Http404('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.get_ordering()):
+            raise Http404('Invalid cursor')
+        return values
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get('after')
+        if cursor is None:
+            paginator, page, rows, is_paginated = super().paginate_queryset(queryset, page_size)
+            self.page_rows = rows
+            self.has_next = page.has_next()
+            return paginator, page, rows, is_paginated
+        try:
+            # values of the wrong type for their fields, e.g. in an edited cursor
+            queryset = queryset.filter(self.get_keyset_filter(self.decode_cursor(cursor)))
+        except (TypeError, ValueError, ValidationError):
+            raise Http404('Invalid cursor')
+        # one row more tells whether there is a next page, without counting
+        rows = list(queryset[:page_size + 1])
+        self.page_rows = rows[:page_size]
+        self.has_next = len(rows) > page_size
+        return None, None, self.page_rows, True
+
+    def get_next_cursor(self):
+        # called from the template, after the rows of the page were loaded for the table
+        if not self.has_next:
+            return None
+        return self.encode_cursor(list(self.page_rows)[-1])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        sort = self.get_sort()
+        context['sort'] = sort
+        # sort parameter of the column headers, the current column toggles its direction
+        context['sort_links'] = {column: '-' + column if sort == column else column for column in self.sort_columns}
+        return context
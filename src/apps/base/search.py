@@ -0,0 +1,65 @@
+from bisect import bisect_left
+from text_unidecode import unidecode
+from .cache import CacheNamespace
+
+
+def normalize(text):
+    # accent-folded and lowercased, so "Łukasz Wójcik" is found by "lukasz wojcik"
+    return unidecode(text).casefold()
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    # In-process index of (key, label) pairs answering autocomplete queries without the database.
+    # Built lazily from loader() and rebuilt after invalidate_on senders change (also in other processes,
+    # through the version in the shared cache). Labels starting with the query come first, then the others
+    # in loader order; labels sharing enough trigrams with the query are the fallback for typos.
+    def __init__(self, name, loader, min_similarity=0.3):
+        self.loader = loader
+        self.min_similarity = min_similarity
+        self.versions = CacheNamespace(f'search:{name}')
+        # (version, entries, sorted tokens, entry of each token), replaced as a whole so searches need no lock
+        self.index = (None, [], [], [])
+
+    def invalidate(self):
+        self.versions.invalidate()
+
+    def invalidate_on(self, sender, fields=None):
+        self.versions.invalidate_on(sender, fields=fields)
+
+    def get_index(self):
+        version = self.versions.get_version()
+        if self.index[0] != version:
+            entries = [(key, label, normalize(label)) for key, label in self.loader()]
+            entries = [(key, label, normalized, trigrams(normalized)) for key, label, normalized in entries]
+            tokens = sorted((token, i) for i, entry in enumerate(entries) for token in set(entry[2].split()))
+            self.index = (version, entries, [token for token, _ in tokens], [i for _, i in tokens])
+        return self.index
+
+    def search(self, q, limit=20, keys=None):
+        # keys restricts the results, e.g. to the projects an employee can book
+        _, entries, tokens, token_entries = self.get_index()
+        allowed = lambda i: keys is None or entries[i][0] in keys
+        words = normalize(q).split()
+        if not words:
+            return [entry[:2] for i, entry in enumerate(entries) if allowed(i)][:limit]
+        # every word of the query starts a word of the label, e.g. "kow j" finds "Jan Kowalski"
+        found = None
+        for word in words:
+            start = bisect_left(tokens, word)
+            end = bisect_left(tokens, word + '\uffff', start)
+            matching = set(token_entries[start:end])
+            found = matching if found is None else found & matching
+        q = ' '.join(words)
+        indexes = sorted((i for i in found if allowed(i)), key=lambda i: (not entries[i][2].startswith(q), i))
+        if not indexes:
+            indexes = [i for i, entry in enumerate(entries) if q in entry[2] and allowed(i)]
+        if not indexes and len(q) >= 3:
+            q_trigrams = trigrams(q)
+            similarities = [(len(q_trigrams & entry[3]) / len(q_trigrams | entry[3]), i) for i, entry in enumerate(entries) if allowed(i)]
+            indexes = [i for similarity, i in sorted(similarities, key=lambda item: (-item[0], item[1])) if similarity >= self.min_similarity]
+        return [entries[i][:2] for i in indexes[:limit]]
@@ -0,0 +1,34 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Thread pool for work that shouldn't hold a request (image resizing, calls to Microsoft Graph).
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='background')
+    return executor
+
+
+def schedule(task, *args):
+    # run in the worker pool, or inline with BACKGROUND_WORKERS = 0 (e.g. in tests)
+    if not settings.BACKGROUND_WORKERS:
+        task(*args)
+        return
+    get_executor().submit(run_in_worker, task, *args)
+
+
+def run_in_worker(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Background task %s failed', task.__name__)
+    finally:
+        # every worker thread has its own connection
+        connection.close()
@@ -3,5 +3,7 @@ from django import template
 register = template.Library()
 
 @register.inclusion_tag('templatetags/show_avatar.html')
-def show_avatar(employee):
-    return({'employee': employee})
\ No newline at end of file
+def show_avatar(employee, size=32, css_class='rounded-circle'):
+    # employee is empty for users without one
+    urls = employee.get_avatar_urls(size) if employee else None
+    return({'employee': employee, 'size': size, 'css_class': css_class, 'urls': urls})
\ No newline at end of file
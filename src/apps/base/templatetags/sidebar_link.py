@@ -1,4 +1,3 @@
-from django.urls import reverse
 from django import template
 
 
@@ -8,7 +7,7 @@ register = template.Library()
 def sidebar_link(context, title, permission, link, icon = 'arrow-right-circle'):
     active = ''
     allowed = False
-    # if context['request'].resolver_match.app_name == link.split(":")[0]: active = 'active'
+    # permissions of the user come from the cache, see backends.py
     if context['request'].resolver_match.app_name == link.split(":")[0]: active = 'active'
     if context['request'].user.has_perm(permission): allowed = True
     return({'title': title, 'allowed': allowed, 'link': link, 'icon': icon, 'active': active})
@@ -1,3 +1,138 @@
-from django.test import TestCase
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ..employees.models import Employee
+from ..projects.models import Project
+from .cache import CacheNamespace
+from . import models
+from .models import permissions_cache, unique_slugify
 
-# Create your tests here.
+
+class CacheNamespaceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.namespace = CacheNamespace('tests:namespace')
+
+    def test_invalidate_drops_all_entries(self):
+        self.namespace.set_many({1: 'a', (2, 'x'): 'b'})
+        self.assertEqual(self.namespace.get_many([1, (2, 'x'), 3]), {1: 'a', (2, 'x'): 'b'})
+        self.namespace.invalidate()
+        self.assertIsNone(self.namespace.get(1))
+        self.assertEqual(self.namespace.get_stats(), {'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
+
+    def test_evicted_version_does_not_restore_entries(self):
+        self.namespace.set(1, 'a')
+        cache.delete('tests:namespace:version')
+        self.assertIsNone(self.namespace.get(1))
+
+
+@override_settings(PERMISSIONS_CACHE=True)
+class PermissionsCacheTest(TestCase):
+    def test_group_change_invalidates_permissions(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com')
+        self.assertFalse(user.has_perm('projects.view_project'))
+        self.assertIsNotNone(permissions_cache.get(user.pk))
+
+        group = Group.objects.create(name='Managers')
+        group.permissions.add(Permission.objects.get(codename='view_project'))
+        user.groups.add(group)
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(2):
+            self.assertTrue(user.has_perm('projects.view_project'))
+        # another request, the permissions come from the cache
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('projects.view_project'))
+
+    @override_settings(PERMISSIONS_CACHE=False)
+    def test_per_request_without_shared_cache(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com')
+        self.assertFalse(user.has_perm('projects.view_project'))
+        self.assertIsNone(permissions_cache.get(user.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(user.has_perm('projects.view_project'))
+
+    def test_invalidated_again_after_commit(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com')
+        group = Group.objects.create(name='Managers')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.groups.add(group)
+            # another request caches the permissions it still reads before the commit
+            permissions_cache.set(user.pk, set())
+        self.assertIsNone(permissions_cache.get(user.pk))
+
+    def test_cache_stats_for_staff_only(self):
+        user = User.objects.create_user('jan.kowalski@example.com')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('base:cache-stats')).status_code, 403)
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('base:cache-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth:permissions', response.json())
+
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_accent_folded_prefix_search(self):
+        for first_name, last_name in [('Łukasz', 'Wójcik'), ('Ioana', 'Ștefănescu'), ('Jan', 'Kowalski')]:
+            user = User.objects.create_user(f'{last_name}@example.com', first_name=first_name, last_name=last_name)
+            Employee.objects.create(user=user)
+        self.assertEqual([name for _, name in Employee.search_index.search('lukasz woj')], ['Łukasz Wójcik'])
+        self.assertEqual([name for _, name in Employee.search_index.search('STEF')], ['Ioana Ștefănescu'])
+        self.assertEqual([name for _, name in Employee.search_index.search('owal')], ['Jan Kowalski'])
+        with self.assertNumQueries(0):
+            Employee.search_index.search('jan')
+
+        user = User.objects.get(last_name='Kowalski')
+        user.is_active = False
+        user.save()
+        self.assertEqual(Employee.search_index.search('jan'), [])
+
+
+class UniqueSlugifyTest(TestCase):
+    def test_numbered_suffixes(self):
+        slugs = [Project.objects.create(name='Mobile App').slug for _ in range(3)]
+        self.assertEqual(slugs, ['mobile-app', 'mobile-app-2', 'mobile-app-3'])
+        self.assertEqual(Project.objects.create(name='All').slug, 'all-2')
+        with self.assertNumQueries(1):
+            self.assertEqual(unique_slugify(Project(), 'Mobile app'), 'mobile-app-4')
+
+    def test_slug_taken_by_concurrent_save(self):
+        Project.objects.create(name='Mobile App')
+        # the first lookup misses the project saved in the meantime
+        with mock.patch.object(models, 'unique_slugify', side_effect=['mobile-app', 'mobile-app-2']):
+            project = Project.objects.create(name='Mobile App')
+        self.assertEqual(project.slug, 'mobile-app-2')
+
+
+@override_settings(PERMISSIONS_CACHE=True)
+class SidebarPermissionsTest(TestCase):
+    def test_permissions_loaded_once_per_user(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        Employee.objects.create(user=user)
+        user.user_permissions.add(Permission.objects.get(codename='view_employee'))
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('employees:employee-list'))
+        self.assertContains(response, reverse('employees:employee-list'))
+        self.assertNotContains(response, reverse('projects:project-list'))
+        self.assertEqual(len([query for query in queries if 'auth_permission' in query['sql']]), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('employees:employee-list'))
+        self.assertEqual([query for query in queries if 'auth_permission' in query['sql']], [])
+
+        user.user_permissions.add(Permission.objects.get(codename='view_project'))
+        self.assertContains(self.client.get(reverse('employees:employee-list')), reverse('projects:project-list'))
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+app_name = 'base'
+urlpatterns = [
+    path('cache-stats/', views.CacheStats.as_view(), name='cache-stats'),
+]
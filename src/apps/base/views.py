@@ -1,3 +1,14 @@
-from django.shortcuts import render
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.http import JsonResponse
+from django.views import generic
 
-# Create your views here.
+from .cache import get_cache_stats
+
+
+class CacheStats(UserPassesTestMixin, generic.View):
+    # hit/miss counters of the process serving the request, for monitoring
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(get_cache_stats())
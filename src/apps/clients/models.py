@@ -1,5 +1,6 @@
 from django.db import models
-from ..base.models import unique_slugify
+from ..base.models import save_with_unique_slug
+from ..base.search import SearchIndex
 
 class Client(models.Model):
     name = models.CharField(max_length=100)
@@ -11,10 +12,14 @@ class Client(models.Model):
 
     def update_slug(self, string_to_slugify):
         if self.slug != string_to_slugify:
-            self.slug = unique_slugify(self, string_to_slugify)
-            self.save()
+            save_with_unique_slug(self, string_to_slugify, self.save)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = unique_slugify(self, self.name)
+            return save_with_unique_slug(self, self.name, lambda: super(Client, self).save(*args, **kwargs))
         super(Client, self).save(*args, **kwargs)
+
+
+# clients for EmClientAutocomplete
+Client.search_index = SearchIndex('clients', lambda: Client.objects.order_by('name').values_list('pk', 'name'))
+Client.search_index.invalidate_on(Client, fields=['name'])
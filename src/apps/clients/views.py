@@ -1,9 +1,9 @@
 from django.views import generic
 from django.contrib.auth.mixins import PermissionRequiredMixin
+from django.http import JsonResponse
 
 from dal import autocomplete
 from .models import Client
-from django.db import models
 
 # class ClientList(generic.ListView):
 class ClientList(PermissionRequiredMixin, generic.ListView):
@@ -24,9 +24,9 @@ class ClientUpdate( generic.UpdateView):
 class ClientDelete( generic.DeleteView):
     pass
 
-class EmClientAutocomplete(autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = Client.objects.all().order_by('name')
-        if self.q:
-            qs = qs.filter(models.Q(name__icontains=self.q))
-        return qs
\ No newline at end of file
+class EmClientAutocomplete(autocomplete.Select2ListView):
+    limit = 20
+
+    def get(self, request, *args, **kwargs):
+        clients = Client.search_index.search(self.q, self.limit)
+        return JsonResponse({'results': [{'id': pk, 'text': name} for pk, name in clients]})
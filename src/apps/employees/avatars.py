@@ -0,0 +1,59 @@
+import hashlib
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+# Avatars are resized outside of the request (see base/tasks.py) into thumbnails named after the checksum
+# of the original, so their urls never change for the same picture and can be cached forever.
+AVATAR_SIZES = (32, 64, 256)
+AVATAR_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP'}
+
+
+def get_thumbnail_name(checksum, size, extension):
+    return f'EmployeeAvatar/{checksum}_{size}.{extension}'
+
+
+def get_checksum(content):
+    return hashlib.md5(content).hexdigest()
+
+
+def process_avatar(employee_id):
+    from .models import Employee
+
+    employee = Employee.objects.filter(pk=employee_id).only('avatar').first()
+    if employee is None or not employee.avatar:
+        return
+    avatar_name = employee.avatar.name
+    with default_storage.open(avatar_name) as file:
+        content = file.read()
+    checksum = get_checksum(content)
+    image = ImageOps.exif_transpose(Image.open(BytesIO(content))).convert('RGB')
+    for size in AVATAR_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for extension, image_format in AVATAR_FORMATS.items():
+            name = get_thumbnail_name(checksum, size, extension)
+            if default_storage.exists(name):
+                continue
+            buffer = BytesIO()
+            thumbnail.save(buffer, image_format, quality=85)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+    # skipped when the avatar was replaced in the meantime, its own task will follow
+    updated = Employee.objects.filter(pk=employee_id, avatar=avatar_name).update(avatar_checksum=checksum, avatar_processed=checksum)
+    if updated:
+        Employee.list_cache.invalidate()
+
+
+def delete_avatar(avatar_name, checksum):
+    from .models import Employee
+
+    default_storage.delete(avatar_name)
+    if not checksum:
+        return
+    # thumbnails are shared by employees with the same picture
+    if Employee.objects.filter(Q(avatar_processed=checksum) | Q(avatar_checksum=checksum)).exists():
+        return
+    for size in AVATAR_SIZES:
+        for extension in AVATAR_FORMATS:
+            default_storage.delete(get_thumbnail_name(checksum, size, extension))
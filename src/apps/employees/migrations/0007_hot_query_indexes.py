@@ -0,0 +1,21 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0006_rename_contract_name_contract_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(fields=['employee', 'start_date', 'end_date'], name='contract_employee_dates'),
+        ),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['employee', 'start_date', 'end_date'], name='rate_employee_dates'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='avatar_processed',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0008_employee_avatar_processed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='avatar_etag',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
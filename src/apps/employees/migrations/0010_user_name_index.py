@@ -0,0 +1,19 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('employees', '0009_employee_avatar_etag'),
+    ]
+
+    # auth.User belongs to django.contrib.auth, the index sorting the employee list by name is added here
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX employees_user_name ON auth_user (last_name, first_name, id)',
+            'DROP INDEX employees_user_name',
+        ),
+    ]
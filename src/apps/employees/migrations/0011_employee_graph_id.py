@@ -0,0 +1,18 @@
+# Generated by Django 4.1.9 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0010_user_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='graph_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
@@ -1,13 +1,17 @@
 import datetime
+from bisect import bisect_left, bisect_right
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.urls.base import reverse
 from django.utils.html import format_html
 from django.shortcuts import  redirect
 from djmoney.models.fields import MoneyField
-from PIL import Image
-from ..base.models import unique_slugify
+from ..base import tasks
+from ..base.cache import CacheNamespace
+from . import avatars
+from ..base.search import SearchIndex
+from ..base.models import save_with_unique_slug
 
 class MonthsInDates:
     def __init__(self, start_date, end_date):
@@ -39,12 +43,139 @@ class MonthsInDates:
             return current_date
         raise StopIteration
 
+class MonthIntervals:
+    # Union of month intervals (e.g. contracts), months are counted as year * 12 + month - 1.
+    # Open intervals end with the next month, like MonthsInDates.
+    def __init__(self):
+        self.intervals = []
+
+    @staticmethod
+    def to_index(date):
+        return date.year * 12 + date.month - 1
+
+    @staticmethod
+    def from_index(index):
+        return datetime.date(index // 12, index % 12 + 1, 1)
+
+    def add(self, start_date, end_date):
+        if end_date is None:
+            end_date = datetime.date.today().replace(day=28) + datetime.timedelta(days=4)
+        self.intervals.append((self.to_index(start_date), self.to_index(end_date)))
+        return self
+
+    def merged(self):
+        merged = []
+        for start, end in sorted(self.intervals):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                continue
+            merged.append((start, end))
+        return merged
+
+    def months_without(self, dates):
+        # the intervals split around the excluded months, only the months left are enumerated
+        excluded = sorted({self.to_index(date) for date in dates})
+        months = []
+        for start, end in self.merged():
+            i = bisect_left(excluded, start)
+            while i < len(excluded) and excluded[i] <= end:
+                months += range(start, excluded[i])
+                start = excluded[i] + 1
+                i += 1
+            months += range(start, end + 1)
+        return [self.from_index(index) for index in months]
+
+class RateTimeline:
+    # All rates of an employee sorted by start date, built with one query and cached across requests.
+    # Rates do not overlap (see RateForm), so lookups by date are a bisect on the start dates.
+    def __init__(self, rates):
+        self.rates = sorted(rates, key=lambda rate: rate.start_date)
+        self.start_dates = [rate.start_date for rate in self.rates]
+
+    # invalidated on Rate changes (see the end of the module), the timeout bounds staleness after
+    # queryset updates, which send no signals
+    cache = CacheNamespace('employees:rate-timeline', 24 * 60 * 60)
+
+    @classmethod
+    def for_employee(cls, employee_id) -> 'RateTimeline':
+        return cls.for_employees([employee_id])[employee_id]
+
+    @classmethod
+    def for_employees(cls, employee_ids) -> dict:
+        # timelines for many employees (e.g. month reports), missing ones are loaded with a single query
+        timelines = cls.cache.get_many(employee_ids)
+        missing = [employee_id for employee_id in employee_ids if employee_id not in timelines]
+        if missing:
+            rates = {employee_id: [] for employee_id in missing}
+            for rate in Rate.objects.filter(employee_id__in=missing):
+                rates[rate.employee_id].append(rate)
+            loaded = {employee_id: cls(employee_rates) for employee_id, employee_rates in rates.items()}
+            cls.cache.set_many(loaded)
+            timelines.update(loaded)
+        return timelines
+
+    def get_rate(self, date: datetime.date):
+        index = bisect_right(self.start_dates, date) - 1
+        if index < 0:
+            return None
+        rate = self.rates[index]
+        if rate.end_date is not None and rate.end_date < date:
+            return None
+        return rate
+
+    def get_rates_for_period(self, start_date: datetime.date, end_date: datetime.date) -> list:
+        first = max(bisect_right(self.start_dates, start_date) - 1, 0)
+        last = bisect_right(self.start_dates, end_date)
+        return [rate for rate in self.rates[first:last] if rate.end_date is None or rate.end_date >= start_date]
+
+class RatesInMonth:
+    # Rates of an employee in a month, loaded with one query and expanded per day only once for each rate type.
+    # Share one instance (e.g. per request) to avoid querying the same rates for every project line.
+    def __init__(self, employee, month_start_date):
+        self.employee = employee
+        self.month_start_date = month_start_date.replace(day=1)
+        next_month = self.month_start_date.replace(day=28) + datetime.timedelta(days=4)
+        self.month_end_date = next_month - datetime.timedelta(days=next_month.day)
+        self.rates = None
+        self.rates_per_day = {}
+
+    def get_rates(self):
+        if self.rates is None:
+            self.rates = self.employee.get_rates_for_period(self.month_start_date, self.month_end_date)
+        return self.rates
+
+    def get_rates_per_day(self, is_chargable: bool) -> dict:
+        if is_chargable in self.rates_per_day:
+            return self.rates_per_day[is_chargable]
+        rates_per_day = {}
+        for rate in self.get_rates():
+            start = max(rate.start_date, self.month_start_date)
+            end = self.month_end_date
+            if rate.end_date is not None:
+                end = min(rate.end_date, self.month_end_date)
+            for i in range(start.day, end.day + 1):
+                if is_chargable:
+                    rates_per_day[i] = rate.chargable
+                    continue
+                rates_per_day[i] = rate.internal
+        self.rates_per_day[is_chargable] = rates_per_day
+        return rates_per_day
+
 class Employee(models.Model):
     slug = models.SlugField(max_length=100, unique=True)
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
     nip = models.CharField(max_length=20, blank=True, null=True)
     avatar = models.ImageField(upload_to='EmployeeAvatar/', blank=True)
     avatar_checksum = models.CharField(blank=True, max_length=50)
+    # checksum of the avatar the thumbnails were generated for, see avatars.py
+    avatar_processed = models.CharField(blank=True, max_length=50)
+    # ETag of the Microsoft Graph photo, to download it only when it changed
+    avatar_etag = models.CharField(blank=True, max_length=100)
+    # id of the Microsoft Graph user, directory changes are matched on it as they may leave out the user principal name
+    graph_id = models.CharField(blank=True, max_length=100, db_index=True)
+
+    # rendered employee list, see employee_list.html
+    list_cache = CacheNamespace('employees:list', 60 * 60)
 
     @classmethod
     def get_list_url(cls):
@@ -64,22 +195,50 @@ class Employee(models.Model):
 
     def update_slug(self, string_to_slugify):
         if self.slug != string_to_slugify:
-            self.slug = unique_slugify(self, string_to_slugify)
-            self.save()
+            save_with_unique_slug(self, string_to_slugify, self.save)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Employee, cls).from_db(db, field_names, values)
+        # to find out in save whether the avatar was replaced
+        loaded = dict(zip(field_names, values))
+        instance._loaded_avatar = (loaded.get('avatar'), loaded.get('avatar_checksum'))
+        return instance
 
     def save(self, *args, **kwargs):
+        loaded_avatar, loaded_checksum = getattr(self, '_loaded_avatar', (None, None))
+        avatar_changed = 'avatar' not in self.get_deferred_fields() and self.avatar.name != loaded_avatar
+        if avatar_changed:
+            self.avatar_processed = ''
         if not self.slug:
             name_to_slugify = self.user.first_name + ' ' + self.user.last_name
-            self.slug = unique_slugify(self, name_to_slugify)
-        if self.avatar:
-            this = Employee.objects.get(user=self.user)
-            if this.avatar != self.avatar:
-                this.avatar.delete(save=False)
-        super(Employee, self).save(*args, **kwargs)
+            save_with_unique_slug(self, name_to_slugify, lambda: super(Employee, self).save(*args, **kwargs))
+        else:
+            super(Employee, self).save(*args, **kwargs)
+        if avatar_changed:
+            self._loaded_avatar = (self.avatar.name, self.avatar_checksum)
+            self.schedule_avatar_tasks(loaded_avatar, loaded_checksum)
+
+    def schedule_avatar_tasks(self, replaced_avatar, replaced_checksum):
+        # after commit: resize the new avatar and remove the replaced one, call it also after bulk_update of avatars
+        # (thumbnails of the same picture, e.g. uploaded again, are still needed)
+        old_checksum = replaced_checksum if replaced_checksum != self.avatar_checksum else None
+        if replaced_avatar:
+            transaction.on_commit(lambda: tasks.schedule(avatars.delete_avatar, replaced_avatar, old_checksum))
         if self.avatar:
-            image = Image.open(self.avatar.path)
-            image = image.resize((256, 256), Image.ANTIALIAS)
-            image.save(self.avatar.path)
+            transaction.on_commit(lambda: tasks.schedule(avatars.process_avatar, self.pk))
+
+    def get_avatar_urls(self, size):
+        # urls of the jpg and webp thumbnails (and double sized ones for high density screens),
+        # None until the thumbnails are generated
+        if not self.avatar or not self.avatar_processed:
+            return None
+        urls = {}
+        for extension in avatars.AVATAR_FORMATS:
+            urls[extension] = self.get_avatar_url(size, extension)
+            if size * 2 in avatars.AVATAR_SIZES:
+                urls[extension + '_2x'] = self.get_avatar_url(size * 2, extension)
+        return urls
 
     def deactivate(self):
         self.user.is_active = False
@@ -99,48 +258,45 @@ class Employee(models.Model):
         today = datetime.date.today()
         return self.contract_set.filter(start_date__lte=today).filter(models.Q(end_date__gte=today) | models.Q(end_date=None) ).first()
 
+    def get_rate_timeline(self) -> RateTimeline:
+        if not hasattr(self, '_rate_timeline'):
+            self._rate_timeline = RateTimeline.for_employee(self.pk)
+        return self._rate_timeline
+
     def get_current_rate(self):
-        today = datetime.date.today()
-        return  self.rate_set.filter(start_date__lte=today).filter(models.Q(end_date__gte=today) | models.Q(end_date=None) ).first()
+        return self.get_rate_timeline().get_rate(datetime.date.today())
 
     def get_rates_for_period(self, start_date, end_date):
-        return self.rate_set.filter(start_date__lte=end_date).filter(models.Q(end_date__gte=start_date) | models.Q(end_date=None) ).all()
+        return self.get_rate_timeline().get_rates_for_period(start_date, end_date)
+
+    def get_rates_in_month(self, month_start_date: datetime.date) -> 'RatesInMonth':
+        return RatesInMonth(self, month_start_date)
 
     def get_dict_of_rates_per_day(self, month_start_date: datetime.date, is_chargable: bool) -> dict():
-        next_month = month_start_date.replace(day=28) + datetime.timedelta(days=4)
-        month_end_date = next_month - datetime.timedelta(days=next_month.day)
-        rates = self.get_rates_for_period(month_start_date, month_end_date)
-        rates_per_day = {}
-        for rate in rates:
-            start = max(rate.start_date, month_start_date)
-            end = month_end_date
-            if rate.end_date is not None:
-                end = min(rate.end_date, month_end_date)
-            for i in range(start.day, end.day + 1):
-                if is_chargable:
-                    rates_per_day[i] = rate.chargable
-                    continue
-                rates_per_day[i] = rate.internal
-        return rates_per_day
+        return self.get_rates_in_month(month_start_date).get_rates_per_day(is_chargable)
 
 
+    empty_time_report_cache = CacheNamespace('employees:empty-time-report', 24 * 60 * 60)
+
+    @classmethod
+    def invalidate_empty_time_report(cls, employee_id):
+        cls.empty_time_report_cache.delete((employee_id, datetime.date.today()))
+
     def get_empty_time_report(self):
-        contract_month_set = set()
-        tr_month_set = set()
-
-        contracts = self.contract_set.all().order_by('start_date')
-        time_reports = self.timereport_set.all().order_by('start_date')
-
-        for contract in contracts:
-            # print(contract.employee , contract, contract.start_date, contract.end_date)
-            for date_in_contract in MonthsInDates(contract.start_date, contract.end_date):
-                # print (date_in_contract)
-                contract_month_set.add(date_in_contract)
-        for time_report in time_reports:
-            for date_in_time_report in MonthsInDates(time_report.start_date, time_report.start_date):
-                tr_month_set.add(date_in_time_report)
-        month_set = contract_month_set - tr_month_set
-        return sorted(list(month_set))
+        # months covered by contracts without a time report, cached until a contract or time report changes
+        # (per day, open-ended contracts depend on today's date)
+        if hasattr(self, '_empty_time_report'):
+            return self._empty_time_report
+        key = (self.pk, datetime.date.today())
+        months = self.empty_time_report_cache.get(key)
+        if months is None:
+            contract_months = MonthIntervals()
+            for start_date, end_date in self.contract_set.values_list('start_date', 'end_date'):
+                contract_months.add(start_date, end_date)
+            months = contract_months.months_without(self.timereport_set.values_list('start_date', flat=True))
+            self.empty_time_report_cache.set(key, months)
+        self._empty_time_report = months
+        return months
     
     def get_absolute_url(self): return reverse("employees:employee-detail", kwargs={"slug": self.slug})
     def get_update_url(self): return reverse("employees:employee-update", kwargs={"slug": self.slug})
@@ -148,6 +304,7 @@ class Employee(models.Model):
     def get_activate_url(self): return reverse("employees:employee-activate", kwargs={"slug": self.slug})
     def get_contract_create_url(self): return reverse("employees:contract-create", kwargs={"slug": self.slug})
     def get_rate_create_url(self): return reverse("employees:rate-create", kwargs={"slug": self.slug})
+    def get_avatar_url(self, size, extension): return reverse("employees:employee-avatar", kwargs={"checksum": self.avatar_processed, "size": size, "extension": extension})
 
 class Contract(models.Model):
     PERMANENT = 'PER'
@@ -163,9 +320,22 @@ class Contract(models.Model):
     type = models.CharField(blank=False, null=False, choices=CONTRACT_TYPES, max_length=3, default=B2B_CONTRACT)
     comment = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['employee', 'start_date', 'end_date'], name='contract_employee_dates'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Contract, self).save(*args, **kwargs)
+        Employee.invalidate_empty_time_report(self.employee_id)
+
+    def delete(self, *args, **kwargs):
+        Employee.invalidate_empty_time_report(self.employee_id)
+        return super(Contract, self).delete(*args, **kwargs)
+
     def have_overlapping_dates(self):
         check_start = self.start_date
         check_end = self.end_date
@@ -197,6 +367,11 @@ class Rate(models.Model):
     end_date = models.DateField(blank=True, null=True)
     comment = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['employee', 'start_date', 'end_date'], name='rate_employee_dates'),
+        ]
+
     def __str__(self):
         # return f"{self.employee.__str__()} - {self.start_date.__str__()}"
         if self.end_date is not None:
@@ -222,4 +397,18 @@ class Rate(models.Model):
 
     def get_absolute_url(self): return reverse("employees:rate-detail", kwargs={"pk": self.pk, "employee": self.employee.slug})
     def get_update_url(self): return reverse("employees:rate-update", kwargs={"pk": self.pk, "employee": self.employee.slug})
-    def get_delete_url(self): return reverse("employees:rate-delete", kwargs={"pk": self.pk, "employee": self.employee.slug})
\ No newline at end of file
+    def get_delete_url(self): return reverse("employees:rate-delete", kwargs={"pk": self.pk, "employee": self.employee.slug})
+
+
+RateTimeline.cache.invalidate_on(Rate, key=lambda rate: rate.employee_id)
+
+Employee.list_cache.invalidate_on(Employee)
+Employee.list_cache.invalidate_on(User, fields=['username', 'first_name', 'last_name', 'is_active'])
+
+# active employees for EmployeeAutocomplete
+Employee.search_index = SearchIndex('employees', lambda: [
+    (pk, first_name + ' ' + last_name) for pk, first_name, last_name in Employee.objects.filter(user__is_active=True)
+    .order_by('user__last_name', 'user__first_name').values_list('pk', 'user__first_name', 'user__last_name')
+])
+Employee.search_index.invalidate_on(Employee)
+Employee.search_index.invalidate_on(User, fields=['first_name', 'last_name', 'is_active'])
@@ -1,3 +1,242 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from djmoney.money import Money
+from PIL import Image
+from . import avatars
+from ..base import cache as cache_module
+from ..time_reports.models import TimeReport
+from .models import Contract, Employee, MonthIntervals, Rate, RateTimeline
 
-# Create your tests here.
+
+def get_image_content(color):
+    buffer = BytesIO()
+    Image.new('RGB', (400, 300), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class AvatarTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, BACKGROUND_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = media_root
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        self.employee = Employee.objects.create(user=user)
+
+    def set_avatar(self, employee, content):
+        checksum = avatars.get_checksum(content)
+        employee.avatar.save(checksum + '.jpg', ContentFile(content), save=False)
+        employee.avatar_checksum = checksum
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            employee.save()
+        return checksum, self.get_avatar_callbacks(callbacks)
+
+    def get_avatar_callbacks(self, callbacks):
+        # without the cache invalidations, which are repeated after the commit too
+        return [callback for callback in callbacks if callback.__module__ != cache_module.__name__]
+
+    def test_thumbnails_generated_after_commit(self):
+        checksum, callbacks = self.set_avatar(self.employee, get_image_content('red'))
+        self.assertEqual(len(callbacks), 1)
+        employee = Employee.objects.get(pk=self.employee.pk)
+        self.assertEqual(employee.avatar_processed, checksum)
+        for size in avatars.AVATAR_SIZES:
+            for extension in avatars.AVATAR_FORMATS:
+                with Image.open(os.path.join(self.media_root, avatars.get_thumbnail_name(checksum, size, extension))) as image:
+                    self.assertEqual(image.size, (size, size))
+        self.assertEqual(set(employee.get_avatar_urls(32)), {'jpg', 'jpg_2x', 'webp', 'webp_2x'})
+
+        # nothing to do when the avatar did not change
+        with self.captureOnCommitCallbacks() as callbacks:
+            employee.nip = '1234567890'
+            employee.save()
+        self.assertEqual(self.get_avatar_callbacks(callbacks), [])
+
+    def test_replaced_avatar_is_deleted(self):
+        old_checksum, _ = self.set_avatar(self.employee, get_image_content('red'))
+        employee = Employee.objects.get(pk=self.employee.pk)
+        checksum, callbacks = self.set_avatar(employee, get_image_content('blue'))
+        self.assertEqual(len(callbacks), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'EmployeeAvatar', old_checksum + '.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, avatars.get_thumbnail_name(old_checksum, 32, 'jpg'))))
+        self.assertEqual(Employee.objects.get(pk=self.employee.pk).avatar_processed, checksum)
+
+    def test_shared_thumbnails_are_kept(self):
+        content = get_image_content('red')
+        checksum, _ = self.set_avatar(self.employee, content)
+        other = Employee.objects.create(user=User.objects.create_user('anna.nowak@example.com'))
+        self.set_avatar(other, content)
+        self.set_avatar(Employee.objects.get(pk=self.employee.pk), get_image_content('blue'))
+        other = Employee.objects.get(pk=other.pk)
+        self.assertEqual(other.avatar_processed, checksum)
+        self.client.force_login(other.user)
+        response = self.client.get(other.get_avatar_url(32, 'jpg'))
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_avatar_served_with_cache_headers(self):
+        checksum, _ = self.set_avatar(self.employee, get_image_content('red'))
+        employee = Employee.objects.get(pk=self.employee.pk)
+        self.client.force_login(employee.user)
+        url = employee.get_avatar_url(64, 'webp')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(response['ETag'], f'"{checksum}-64"')
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{checksum}-64"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(employee.get_avatar_url(48, 'webp')).status_code, 404)
+
+
+class EmployeeListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_superuser('admin@example.com', first_name='Ada', last_name='Admin')
+        Employee.objects.create(user=user)
+        self.client.force_login(user)
+
+    def create_employees(self, names):
+        for first_name, last_name in names:
+            user = User.objects.create_user(f'{first_name}.{last_name}@example.com'.lower(), first_name=first_name, last_name=last_name)
+            Employee.objects.create(user=user)
+
+    def get_names(self, **params):
+        cache.clear()
+        response = self.client.get(reverse('employees:employee-list'), params)
+        return [str(employee) for employee in response.context['employees']]
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.create_employees([('Jan', 'Kowalski'), ('Anna', 'Nowak')])
+        self.get_names()
+        with self.assertNumQueries(5) as queries:
+            self.get_names()
+        self.create_employees([('Piotr', 'Wojcik'), ('Ewa', 'Lis')])
+        with self.assertNumQueries(len(queries)):
+            self.assertEqual(self.get_names(), ['Ada Admin', 'Jan Kowalski', 'Ewa Lis', 'Anna Nowak', 'Piotr Wojcik'])
+
+    def test_sort_columns(self):
+        self.create_employees([('Jan', 'Kowalski'), ('Anna', 'Nowak')])
+        self.assertEqual(self.get_names(sort='-name'), ['Anna Nowak', 'Jan Kowalski', 'Ada Admin'])
+        self.assertEqual(self.get_names(sort='email'), ['Ada Admin', 'Anna Nowak', 'Jan Kowalski'])
+        # unknown columns fall back to the default
+        self.assertEqual(self.get_names(sort='nip'), ['Ada Admin', 'Jan Kowalski', 'Anna Nowak'])
+
+
+class RateTimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        self.employee = Employee.objects.create(user=user)
+        self.january = self.create_rate(100, datetime.date(2023, 1, 1), datetime.date(2023, 1, 31))
+        # gap in February
+        self.march = self.create_rate(120, datetime.date(2023, 3, 1), datetime.date(2023, 3, 15))
+        self.open_ended = self.create_rate(150, datetime.date(2023, 3, 16))
+
+    def create_rate(self, amount, start_date, end_date=None, employee=None):
+        return Rate.objects.create(
+            employee=employee or self.employee, chargable=Money(amount, 'PLN'), internal=Money(amount / 2, 'PLN'),
+            start_date=start_date, end_date=end_date,
+        )
+
+    def test_get_rate(self):
+        timeline = RateTimeline.for_employee(self.employee.pk)
+        self.assertIsNone(timeline.get_rate(datetime.date(2022, 12, 31)))
+        self.assertEqual(timeline.get_rate(datetime.date(2023, 1, 1)), self.january)
+        self.assertEqual(timeline.get_rate(datetime.date(2023, 1, 31)), self.january)
+        self.assertIsNone(timeline.get_rate(datetime.date(2023, 2, 10)))
+        self.assertEqual(timeline.get_rate(datetime.date(2023, 3, 15)), self.march)
+        self.assertEqual(timeline.get_rate(datetime.date(2030, 1, 1)), self.open_ended)
+
+    def test_get_rates_for_period(self):
+        timeline = RateTimeline.for_employee(self.employee.pk)
+        get_rates = lambda start_date, end_date: timeline.get_rates_for_period(start_date, end_date)
+        # starting before the first rate
+        self.assertEqual(get_rates(datetime.date(2022, 12, 1), datetime.date(2023, 1, 10)), [self.january])
+        self.assertEqual(get_rates(datetime.date(2022, 11, 1), datetime.date(2022, 11, 30)), [])
+        self.assertEqual(get_rates(datetime.date(2023, 2, 1), datetime.date(2023, 2, 28)), [])
+        self.assertEqual(get_rates(datetime.date(2023, 1, 15), datetime.date(2023, 3, 1)), [self.january, self.march])
+        self.assertEqual(get_rates(datetime.date(2023, 3, 1), datetime.date(2023, 3, 31)), [self.march, self.open_ended])
+        self.assertEqual(get_rates(datetime.date(2024, 6, 1), datetime.date(2024, 6, 30)), [self.open_ended])
+
+    def test_for_employees_loads_misses_with_one_query(self):
+        employees = [self.employee]
+        for name in ['anna.nowak', 'piotr.wojcik']:
+            employee = Employee.objects.create(user=User.objects.create_user(f'{name}@example.com'))
+            employees.append(employee)
+        self.create_rate(200, datetime.date(2023, 1, 1), employee=employees[1])
+        RateTimeline.for_employee(self.employee.pk)
+        employee_ids = [employee.pk for employee in employees]
+        with self.assertNumQueries(1):
+            timelines = RateTimeline.for_employees(employee_ids)
+        self.assertEqual(len(timelines[employee_ids[0]].rates), 3)
+        self.assertEqual(len(timelines[employee_ids[1]].rates), 1)
+        self.assertEqual(timelines[employee_ids[2]].rates, [])
+        with self.assertNumQueries(0):
+            RateTimeline.for_employees(employee_ids)
+
+    def test_invalidated_on_save_and_delete(self):
+        RateTimeline.for_employee(self.employee.pk)
+        self.open_ended.end_date = datetime.date(2023, 12, 31)
+        self.open_ended.save()
+        with self.assertNumQueries(1):
+            self.assertIsNone(RateTimeline.for_employee(self.employee.pk).get_rate(datetime.date(2024, 1, 1)))
+        self.january.delete()
+        with self.assertNumQueries(1):
+            self.assertIsNone(RateTimeline.for_employee(self.employee.pk).get_rate(datetime.date(2023, 1, 1)))
+        # queryset deletes send post_delete as well
+        Rate.objects.filter(employee=self.employee, start_date__gte=datetime.date(2023, 3, 16)).delete()
+        self.assertEqual(RateTimeline.for_employee(self.employee.pk).rates, [self.march])
+
+
+class EmptyTimeReportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        self.employee = Employee.objects.create(user=user)
+        self.contract = Contract.objects.create(
+            employee=self.employee, name='B2B', sign_date=datetime.date(2023, 1, 1),
+            start_date=datetime.date(2023, 1, 10), end_date=datetime.date(2023, 4, 30),
+        )
+
+    def get_empty_time_report(self, queries):
+        with self.assertNumQueries(queries):
+            return Employee.objects.get(pk=self.employee.pk).get_empty_time_report()
+
+    def test_months_without(self):
+        months = MonthIntervals()
+        months.add(datetime.date(2022, 11, 1), datetime.date(2023, 2, 28)).add(datetime.date(2023, 2, 1), datetime.date(2023, 3, 31))
+        months.add(datetime.date(2023, 6, 1), datetime.date(2023, 7, 31))
+        reported = [datetime.date(2022, 10, 1), datetime.date(2022, 11, 1), datetime.date(2023, 1, 1), datetime.date(2023, 7, 1)]
+        self.assertEqual(months.months_without(reported), [
+            datetime.date(2022, 12, 1), datetime.date(2023, 2, 1), datetime.date(2023, 3, 1), datetime.date(2023, 6, 1),
+        ])
+
+    def test_cache_invalidated_by_contracts_and_time_reports(self):
+        months = [datetime.date(2023, month, 1) for month in range(1, 5)]
+        # employee, contracts and time reports
+        self.assertEqual(self.get_empty_time_report(3), months)
+        self.assertEqual(self.get_empty_time_report(1), months)
+
+        time_report = TimeReport.objects.create(employee=self.employee, start_date=datetime.date(2023, 2, 1))
+        self.assertEqual(self.get_empty_time_report(3), [months[0]] + months[2:])
+        time_report.delete()
+        self.assertEqual(self.get_empty_time_report(3), months)
+
+        self.contract.end_date = datetime.date(2023, 2, 28)
+        self.contract.save()
+        self.assertEqual(self.get_empty_time_report(3), months[:2])
+        self.contract.delete()
+        self.assertEqual(self.get_empty_time_report(3), [])
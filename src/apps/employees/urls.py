@@ -7,6 +7,7 @@ urlpatterns = [
     path('all/', views.EmployeeList.as_view(), name='employee-list-all', kwargs={'all': True}),
     path('new/', views.EmployeeCreate.as_view(), name='employee-create'),
     path('api/', views.EmployeeAutocomplete.as_view(), name='employee-autocomplete'),
+    path('avatar/<str:checksum>/<int:size>.<str:extension>', views.EmployeeAvatar.as_view(), name='employee-avatar'),
     path('<slug:slug>/', views.EmployeeDetail.as_view(), name='employee-detail'),
     path('<slug:slug>/edit', views.EmployeeUpdate.as_view(), name='employee-update'),
     path('<slug:slug>/deactivate', views.EmployeeDeactivate.as_view(), name='employee-deactivate'),
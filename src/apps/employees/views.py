@@ -2,14 +2,17 @@ from django.contrib import messages
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import JsonResponse
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.html import format_html
 from django.views import generic
 
-from django.db import models
 from dal import autocomplete
 
+from ..base.pagination import SortedListMixin
+from . import avatars
 from .forms import ContractForm, EmployeeCreateForm, EmployeeUpdateForm, RateForm
 from .models import Contract, Employee, Rate
 
@@ -38,14 +41,24 @@ class EmployeeCreate(PermissionRequiredMixin, SuccessMessageMixin, generic.FormV
         return self.employee.get_absolute_url()
 
 
-class EmployeeList(PermissionRequiredMixin, generic.ListView):
+class EmployeeList(PermissionRequiredMixin, SortedListMixin, generic.ListView):
     permission_required = 'employees.view_employee'
     model = Employee
     context_object_name = 'employees'
+    # auth_user indexes, see migration 0010
+    sort_columns = {'name': ('user__last_name', 'user__first_name'), 'email': ('user__username',)}
+    default_sort = 'name'
+
     def get_queryset(self):
+        employees = super().get_queryset().select_related('user')
         if self.kwargs['all']:
-            return self.model.objects.all()
-        return self.model.objects.filter(user__is_active=True)
+            return employees
+        return employees.filter(user__is_active=True)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['list_cache_version'] = Employee.list_cache.get_version()
+        return context
 
 
 class EmployeeDetail(PermissionRequiredMixin, generic.DetailView):
@@ -315,9 +328,29 @@ class RateDelete(PermissionRequiredMixin, generic.DeleteView):
         return redirect(rate.employee.get_absolute_url())
 
 
-class EmployeeAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-        qs = Employee.objects.all().filter(user__is_active=True).order_by('user__last_name')
-        if self.q:
-            qs = qs.filter(models.Q(user__first_name__icontains=self.q) | models.Q(user__last_name__icontains=self.q))
-        return qs
+class EmployeeAutocomplete(LoginRequiredMixin, autocomplete.Select2ListView):
+    limit = 20
+
+    def get(self, request, *args, **kwargs):
+        employees = Employee.search_index.search(self.q, self.limit)
+        return JsonResponse({'results': [{'id': pk, 'text': name} for pk, name in employees]})
+
+
+class EmployeeAvatar(LoginRequiredMixin, generic.View):
+    # Thumbnails are named after the checksum of the picture and never change, so browsers keep them for a year
+    # and revalidate with the ETag afterwards.
+    content_types = {'jpg': 'image/jpeg', 'webp': 'image/webp'}
+
+    def get(self, request, checksum, size, extension):
+        if size not in avatars.AVATAR_SIZES or extension not in avatars.AVATAR_FORMATS:
+            raise Http404
+        etag = f'"{checksum}-{size}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            name = avatars.get_thumbnail_name(checksum, size, extension)
+            if not default_storage.exists(name):
+                raise Http404
+            response = FileResponse(default_storage.open(name), content_type=self.content_types[extension])
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=365 * 24 * 60 * 60, immutable=True)
+        return response
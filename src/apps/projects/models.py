@@ -1,6 +1,8 @@
 from django.db import models
 from django.urls import reverse
-from ..base.models import unique_slugify
+from ..base.cache import CacheNamespace
+from ..base.models import save_with_unique_slug
+from ..base.search import SearchIndex
 
 # Create your models here.
 class Project(models.Model):
@@ -13,22 +15,46 @@ class Project(models.Model):
     managers = models.ManyToManyField('employees.Employee', related_name='managers')
     members = models.ManyToManyField('employees.Employee', related_name='members', blank=True)
 
+    bookable_cache = CacheNamespace('projects:bookable', 60 * 60)
+
+    class Meta:
+        # sort columns of the project list, see ProjectList
+        indexes = [
+            models.Index(fields=['name', 'id'], name='project_name'),
+            models.Index(fields=['is_active', 'name', 'id'], name='project_active_name'),
+        ]
+
     def __str__(self):
         return self.name
 
     def update_slug(self, string_to_slugify):
         if self.slug != string_to_slugify:
-            self.slug = unique_slugify(self, string_to_slugify)
-            self.save()
+            save_with_unique_slug(self, string_to_slugify, self.save)
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = unique_slugify(self, self.name)
+            return save_with_unique_slug(self, self.name, lambda: super(Project, self).save(*args, **kwargs))
         super(Project, self).save(*args, **kwargs)
 
+    @classmethod
+    def get_bookable_ids(cls, employee_id) -> set:
+        # active projects the employee can report time on: public ones and the ones they are a member of
+        return cls.bookable_cache.get_or_set(employee_id, lambda: set(
+            cls.objects.filter(is_active=True).filter(models.Q(is_public=True) | models.Q(members=employee_id))
+            .values_list('pk', flat=True)
+        ))
+
     def get_absolute_url(self): return reverse("projects:project-detail", kwargs={"slug": self.slug})
     def get_update_url(self): return reverse("projects:project-update", kwargs={"slug": self.slug})
     def get_activate_url(self): return reverse("projects:project-activate", kwargs={"slug": self.slug})
     def get_deactivate_url(self): return reverse("projects:project-deactivate", kwargs={"slug": self.slug})
     def get_update_url(self): return reverse("projects:project-update", kwargs={"slug": self.slug})
-    def get_list_url(): return reverse("projects:project-list")
\ No newline at end of file
+    def get_list_url(): return reverse("projects:project-list")
+
+
+Project.bookable_cache.invalidate_on(Project, fields=['name', 'is_active', 'is_public'])
+Project.bookable_cache.invalidate_on(Project.members.through)
+
+# active projects for ProjectAutocomplete, restricted to get_bookable_ids of the user
+Project.search_index = SearchIndex('projects', lambda: Project.objects.filter(is_active=True).order_by('name').values_list('pk', 'name'))
+Project.search_index.invalidate_on(Project, fields=['name', 'is_active'])
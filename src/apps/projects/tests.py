@@ -1,3 +1,106 @@
+import base64
+import json
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from unittest import mock
+from ..clients.models import Client
+from ..employees.models import Employee
+from .models import Project
+from .views import ProjectList
 
-# Create your tests here.
+
+class ProjectAutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        cls.employee = Employee.objects.create(user=user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.employee.user)
+
+    def get_results(self, q=''):
+        response = self.client.get(reverse('projects:project-autocomplete'), {'q': q})
+        return [result['text'] for result in response.json()['results']]
+
+    def test_bookable_projects(self):
+        public = Project.objects.create(name='Alpha')
+        public.members.add(self.employee)
+        hidden = Project.objects.create(name='Beta', is_public=False)
+        Project.objects.create(name='Gamma', is_active=False)
+        self.assertEqual(self.get_results(), ['Alpha'])
+
+        hidden.members.add(self.employee)
+        self.assertEqual(self.get_results(), ['Alpha', 'Beta'])
+        public.is_active = False
+        public.save()
+        self.assertEqual(self.get_results(), ['Beta'])
+
+    def test_results_come_from_cache(self):
+        Project.objects.create(name='Alpha')
+        self.get_results()
+        # session and user only
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_results('alp'), ['Alpha'])
+
+    def test_search_order(self):
+        for name in ['Internal tools', 'Tooling', 'Mobile app', 'Website tools', 'Atoolkit', 'Tools archive']:
+            Project.objects.create(name=name)
+        Project.objects.filter(name='Tools archive').update(is_public=False)
+        # labels starting with the query first, then the other word prefixes, substrings and typos
+        self.assertEqual(self.get_results('tool'), ['Tooling', 'Internal tools', 'Website tools'])
+        self.assertEqual(self.get_results('oolk'), ['Atoolkit'])
+        self.assertEqual(self.get_results('moblie app'), ['Mobile app'])
+
+
+class ProjectListTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_superuser('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        cls.employee = Employee.objects.create(user=user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.employee.user)
+
+    def create_projects(self, names):
+        client = Client.objects.create(name='Acme')
+        for name in names:
+            project = Project.objects.create(name=name, client=client)
+            project.managers.add(self.employee)
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.create_projects(['Alpha', 'Beta'])
+        self.client.get(reverse('projects:project-list'))
+        with self.assertNumQueries(6) as queries:
+            response = self.client.get(reverse('projects:project-list'))
+        self.assertContains(response, 'Jan Kowalski', count=2)
+
+        self.create_projects(['Gamma', 'Delta', 'Epsilon'])
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(reverse('projects:project-list'))
+        self.assertContains(response, 'Jan Kowalski', count=5)
+
+    def test_keyset_pages(self):
+        names = ['Alpha', 'Beta', 'Delta', 'Epsilon', 'Gamma']
+        self.create_projects(reversed(names))
+        with mock.patch.object(ProjectList, 'paginate_by', 2):
+            for sort, expected in (('name', names), ('-name', names[::-1])):
+                response = self.client.get(reverse('projects:project-list'), {'sort': sort})
+                pages = [[project.name for project in response.context['projects']]]
+                while cursor := response.context['view'].get_next_cursor():
+                    response = self.client.get(reverse('projects:project-list'), {'sort': sort, 'after': cursor})
+                    self.assertIsNone(response.context['page_obj'])
+                    pages.append([project.name for project in response.context['projects']])
+                self.assertEqual(pages, [expected[:2], expected[2:4], expected[4:]])
+        self.assertEqual(self.client.get(reverse('projects:project-list'), {'after': 'invalid'}).status_code, 404)
+
+    def test_cursor_with_wrong_types(self):
+        self.create_projects(['Alpha'])
+        for values in (['Alpha', 'x'], ['Alpha', [1]], ['x', 'Alpha', 1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            sort = 'status' if len(values) == 3 else 'name'
+            response = self.client.get(reverse('projects:project-list'), {'sort': sort, 'after': cursor})
+            self.assertEqual(response.status_code, 404)
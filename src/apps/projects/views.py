@@ -4,20 +4,27 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 from django.utils.html import format_html
 from django.shortcuts import get_object_or_404, redirect
+from django.db.models import Prefetch
 from django.http import JsonResponse
 from .models import Project
 from .forms import ProjectForm
-from django.db import models
+from ..base.pagination import SortedListMixin
+from ..employees.models import Employee
 from dal import autocomplete
 
-class ProjectList(PermissionRequiredMixin, generic.ListView):
+class ProjectList(PermissionRequiredMixin, SortedListMixin, generic.ListView):
     permission_required = 'projects.view_project'
     model = Project
     context_object_name = 'projects'
+    sort_columns = {'name': ('name',), 'status': ('is_active', 'name')}
+    default_sort = 'name'
+
     def get_queryset(self):
+        projects = super().get_queryset().select_related('client').prefetch_related(
+            Prefetch('managers', queryset=Employee.objects.select_related('user')))
         if self.kwargs['all']:
-            return self.model.objects.all()
-        return self.model.objects.filter(is_active=True)
+            return projects
+        return projects.filter(is_active=True)
         
 class ProjectDetail(PermissionRequiredMixin, generic.DetailView):
     permission_required = 'projects.view_project'
@@ -102,14 +109,11 @@ class ProjectActivate(ProjectToggle):
         messages.success(request, format_html("Project <strong>{}</strong> has been activated", self.project))
         return redirect(self.project.get_absolute_url())
 
-class ProjectAutocomplete(LoginRequiredMixin, autocomplete.Select2QuerySetView):
-    def get_queryset(self):
-
-        # Don't forget to filter out results depending on the visitor !
+class ProjectAutocomplete(LoginRequiredMixin, autocomplete.Select2ListView):
+    # matched in memory against the project search index and the cached bookable projects of the user,
+    # the time entry grid queries it on every keystroke (employees share the pk of their user)
+    limit = 20
 
-        # filter all active visible projects and hidden projects where user is member
-        qs = Project.objects.all().filter(is_active=True).filter(models.Q(is_public=True) | models.Q(members__in=[self.request.user.employee])).order_by('name')  
-        # qs = Project.objects.all().filter(user__is_active=True).order_by('user__last_name')
-        if self.q:
-            qs = qs.filter(models.Q(name__icontains=self.q))
-        return qs
\ No newline at end of file
+    def get(self, request, *args, **kwargs):
+        projects = Project.search_index.search(self.q, self.limit, keys=Project.get_bookable_ids(request.user.pk))
+        return JsonResponse({'results': [{'id': pk, 'text': name} for pk, name in projects]})
@@ -0,0 +1,78 @@
+import threading
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..employees import avatars
+from ..employees.models import Employee
+
+# Microsoft Graph is only called from background tasks (see base/tasks.py), through one pooled session
+# retrying throttled (429) and failed requests with backoff.
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=('GET',), respect_retry_after_header=True, raise_on_status=False,
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_maxsize=max(settings.BACKGROUND_WORKERS, 10))
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+def get(url, access_token, headers=None, **kwargs):
+    # url relative to GRAPH_URL or absolute (e.g. @odata.nextLink)
+    if not url.startswith('http'):
+        url = settings.GRAPH_URL + url
+    headers = {'Authorization': 'Bearer ' + access_token, **(headers or {})}
+    return get_session().get(url, headers=headers, timeout=(3.05, settings.GRAPH_TIMEOUT), **kwargs)
+
+
+def update_names(user, given_name, surname):
+    given_name, surname = given_name or '', surname or ''
+    if (user.first_name, user.last_name) == (given_name, surname):
+        return False
+    user.first_name = given_name
+    user.last_name = surname
+    user.save(update_fields=['first_name', 'last_name'])
+    return True
+
+
+def update_avatar(employee, content, etag):
+    checksum = avatars.get_checksum(content)
+    if employee.avatar_checksum != checksum:
+        # resized in the background by Employee.save
+        employee.avatar.save(checksum + '.jpg', ContentFile(content), save=False)
+        employee.avatar_checksum = checksum
+    employee.avatar_etag = etag
+    # only the avatar, not to overwrite fields changed meanwhile by the employee form
+    employee.save(update_fields=['avatar', 'avatar_checksum', 'avatar_etag', 'avatar_processed'])
+
+
+def sync_user(user_id, access_token):
+    # refresh names and photo of a user who just logged in
+    user = User.objects.get(pk=user_id)
+    response = get('/me', access_token, params={'$select': 'givenName,surname'})
+    response.raise_for_status()
+    profile = response.json()
+    update_names(user, profile.get('givenName'), profile.get('surname'))
+
+    employee = Employee.objects.filter(user=user).first()
+    if employee is None:
+        return
+    headers = {'If-None-Match': employee.avatar_etag} if employee.avatar_etag and employee.avatar else {}
+    response = get('/me/photo/$value', access_token, headers=headers)
+    if response.status_code in (requests.codes.not_modified, requests.codes.not_found):
+        return
+    response.raise_for_status()
+    update_avatar(employee, response.content, response.headers.get('ETag', ''))
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from ....employees import avatars
+from ....employees.models import Employee
+from ... import graph, views
+from ...models import DirectoryCheckpoint
+
+CHECKPOINT = 'users'
+DELTA_URL = '/users/delta?$select=userPrincipalName,givenName,surname'
+
+
+class Command(BaseCommand):
+    help = ('Update names and photos of existing users from the Microsoft Graph directory. '
+            'Runs after the first one only process users changed since the previous run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Ignore the checkpoint and go through all users.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent photo downloads.')
+        parser.add_argument('--no-photos', action='store_true')
+
+    def handle(self, *args, **options):
+        self.access_token = views.get_application_token()
+        self.workers = options['workers']
+        self.photos = not options['no_photos']
+        checkpoint, _ = DirectoryCheckpoint.objects.get_or_create(name=CHECKPOINT)
+        url = DELTA_URL if options['full'] else checkpoint.next_link or checkpoint.delta_link or DELTA_URL
+        updated = 0
+        while url:
+            response = graph.get(url, self.access_token)
+            if response.status_code == requests.codes.gone:
+                # the delta token expired, start over
+                self.stdout.write('Checkpoint expired, syncing all users.')
+                url = DELTA_URL
+                continue
+            if not response.ok:
+                raise CommandError(f'Graph responded {response.status_code}: {response.text}')
+            page = response.json()
+            # Graph requests and files come first, the transaction only holds the writes of the page
+            # and its checkpoint, which are committed together so an interrupted run continues with the next page
+            renamed, employees, replaced = self.get_changes(page['value'])
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_update(renamed, ['first_name', 'last_name'])
+                    Employee.objects.bulk_update(employees, ['graph_id', 'avatar', 'avatar_checksum', 'avatar_etag', 'avatar_processed'])
+                    for employee, avatar, checksum in replaced:
+                        employee.schedule_avatar_tasks(avatar, checksum)
+                    checkpoint.next_link = page.get('@odata.nextLink', '')
+                    if '@odata.deltaLink' in page:
+                        checkpoint.delta_link = page['@odata.deltaLink']
+                    checkpoint.save()
+            except Exception:
+                for employee, _, _ in replaced:
+                    default_storage.delete(employee.avatar.name)
+                raise
+            if renamed or replaced:
+                # bulk_update sends no signals
+                Employee.list_cache.invalidate()
+                Employee.search_index.invalidate()
+            updated += len({user.pk for user in renamed} | {employee.pk for employee, _, _ in replaced})
+            url = checkpoint.next_link
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} users.'))
+
+    def get_changes(self, graph_users):
+        # users removed from the directory and unknown to the app are skipped, accounts are never created here.
+        # Employees are matched on their Graph id, and on the user principal name until the id is stored.
+        # Delta pages only hold the changed properties, the missing ones are left as they are.
+        # Returns renamed users, employees with a new Graph id, photo or ETag and (employee, replaced avatar, checksum) of new photos.
+        graph_users = [graph_user for graph_user in graph_users if '@removed' not in graph_user]
+        by_id = {graph_user['id']: graph_user for graph_user in graph_users}
+        by_name = {graph_user['userPrincipalName']: graph_user for graph_user in graph_users if graph_user.get('userPrincipalName')}
+        users = User.objects.filter(Q(employee__graph_id__in=by_id) | Q(username__in=by_name)).select_related('employee')
+        renamed = []
+        linked = []
+        employees = []
+        for user in users:
+            employee = getattr(user, 'employee', None)
+            if employee is not None and employee.graph_id:
+                graph_user = by_id.get(employee.graph_id)
+            else:
+                graph_user = by_name.get(user.username)
+            if graph_user is None:
+                continue
+            names = (graph_user.get('givenName', user.first_name) or '', graph_user.get('surname', user.last_name) or '')
+            if (user.first_name, user.last_name) != names:
+                user.first_name, user.last_name = names
+                renamed.append(user)
+            if employee is None:
+                continue
+            if employee.graph_id != graph_user['id']:
+                employee.graph_id = graph_user['id']
+                linked.append(employee)
+            employees.append(employee)
+        if not self.photos:
+            return renamed, linked, []
+        updated, replaced = self.get_photos(employees)
+        return renamed, list({employee.pk: employee for employee in linked + updated}.values()), replaced
+
+    def get_photo(self, graph_user_id, etag):
+        headers = {'If-None-Match': etag} if etag else {}
+        return graph.get(f'/users/{graph_user_id}/photo/$value', self.access_token, headers=headers)
+
+    def get_photos(self, employees):
+        # downloads run concurrently, new photos are written to the storage but not saved to the database
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            responses = executor.map(
+                lambda employee: self.get_photo(employee.graph_id, employee.avatar.name and employee.avatar_etag),
+                employees,
+            )
+            responses = list(responses)
+        updated = []
+        replaced = []
+        for employee, response in zip(employees, responses):
+            if response.status_code != requests.codes.ok:
+                continue
+            etag = response.headers.get('ETag', '')
+            checksum = avatars.get_checksum(response.content)
+            if checksum != employee.avatar_checksum:
+                replaced.append((employee, employee.avatar.name, employee.avatar_checksum))
+                employee.avatar.save(checksum + '.jpg', ContentFile(response.content), save=False)
+                employee.avatar_checksum = checksum
+                employee.avatar_processed = ''
+            elif etag == employee.avatar_etag:
+                continue
+            employee.avatar_etag = etag
+            updated.append(employee)
+        return updated, replaced
@@ -1,3 +1,13 @@
 from django.db import models
 
-# Create your models here.
+
+class DirectoryCheckpoint(models.Model):
+    # Where the last sync_directory run stopped: the next page of an interrupted run,
+    # or the delta link returning only users changed since the finished one.
+    name = models.CharField(max_length=50, unique=True)
+    next_link = models.TextField(blank=True)
+    delta_link = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
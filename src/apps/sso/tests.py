@@ -1,3 +1,314 @@
-from django.test import TestCase
+import base64
+import json
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from ..employees.models import Employee
+from ..employees.avatars import get_checksum
+from . import graph, views
+from .management.commands import sync_directory
+from .models import DirectoryCheckpoint
 
-# Create your tests here.
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self.text = json.dumps(payload)
+        self.content = self.text.encode()
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeAuthority:
+    # http client answering the OIDC discovery and token requests of MSAL locally
+    def __init__(self):
+        self.requests = []
+        self.claims = {'preferred_username': 'jan.kowalski@example.com', 'upn': 'jan.kowalski@example.com'}
+
+    def get(self, url, **kwargs):
+        self.requests.append(('GET', url))
+        if url.endswith('/.well-known/openid-configuration'):
+            return FakeResponse({
+                'authorization_endpoint': views.AUTHORITY + '/oauth2/v2.0/authorize',
+                'token_endpoint': views.AUTHORITY + '/oauth2/v2.0/token',
+                'issuer': views.AUTHORITY + '/v2.0',
+            })
+        return FakeResponse({'error': 'not_found'}, 404)
+
+    def post(self, url, **kwargs):
+        self.requests.append(('POST', url))
+        claims = {
+            'iss': views.AUTHORITY + '/v2.0', 'aud': 'client', 'sub': 'subject', 'exp': int(time.time()) + 3600,
+            **self.claims,
+        }
+        id_token = '.'.join(base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=') for part in ({}, claims, {}))
+        return FakeResponse({
+            'token_type': 'Bearer', 'scope': 'User.Read', 'expires_in': 3600,
+            'access_token': 'access-token', 'refresh_token': 'refresh-token', 'id_token': id_token,
+        })
+
+    def close(self):
+        pass
+
+
+@override_settings(MSAL_CLIENT_ID='client')
+class MsalAppTest(TestCase):
+    def setUp(self):
+        self.authority = FakeAuthority()
+        for patcher in (mock.patch.object(views, '_http_client', self.authority), mock.patch.object(views, '_http_cache', {})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def count_requests(self, method, suffix):
+        return len([url for request_method, url in self.authority.requests if request_method == method and url.endswith(suffix)])
+
+    def test_discovery_fetched_once(self):
+        for _ in range(3):
+            response = self.client.get(reverse('sso:redirect'))
+            self.assertTrue(response['Location'].startswith(views.AUTHORITY + '/oauth2/v2.0/authorize'))
+        self.assertEqual(self.count_requests('GET', '/.well-known/openid-configuration'), 1)
+
+    def test_token_cache_stored_in_session(self):
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        Employee.objects.create(user=user)
+        self.client.get(reverse('sso:redirect'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.get(reverse('sso:callback'), {'state': self.client.session['state'], 'code': 'code'})
+        # Graph sync scheduled after the response
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+        token_cache = json.loads(self.client.session[views.TOKEN_CACHE_SESSION_KEY])
+        self.assertEqual([token['secret'] for token in token_cache['AccessToken'].values()], ['access-token'])
+        self.assertEqual(self.count_requests('POST', '/oauth2/v2.0/token'), 1)
+        self.assertEqual(self.count_requests('GET', '/.well-known/openid-configuration'), 1)
+
+
+    def log_in(self):
+        self.client.get(reverse('sso:redirect'))
+        return self.client.get(reverse('sso:callback'), {'state': self.client.session['state'], 'code': 'code'})
+
+    def test_user_matched_on_upn(self):
+        # a guest: preferred_username is their own email, the UPN is the one of the tenant
+        guest = User.objects.create_user('jan.kowalski_example.com#EXT#@tenant.onmicrosoft.com')
+        User.objects.create_user('jan.kowalski@example.com')
+        self.authority.claims['upn'] = guest.username
+        with mock.patch.object(views.graph, 'get') as graph_get:
+            self.log_in()
+        graph_get.assert_not_called()
+        self.assertEqual(int(self.client.session['_auth_user_id']), guest.pk)
+
+    def test_upn_read_from_graph_without_claim(self):
+        user = User.objects.create_user('jan.kowalski@tenant.onmicrosoft.com')
+        User.objects.create_user('jan.kowalski@example.com')
+        del self.authority.claims['upn']
+        with mock.patch.object(views.graph, 'get', return_value=FakeResponse({'userPrincipalName': user.username})) as graph_get:
+            self.log_in()
+        graph_get.assert_called_once_with('/me', 'access-token', params={'$select': 'userPrincipalName'})
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+
+        self.client.logout()
+        with mock.patch.object(views.graph, 'get', return_value=FakeResponse({}, 503)):
+            self.log_in()
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_refresh_with_silently_renewed_token(self):
+        user = User.objects.create_user('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        Employee.objects.create(user=user)
+        self.client.get(reverse('sso:redirect'))
+        self.client.get(reverse('sso:callback'), {'state': self.client.session['state'], 'code': 'code'})
+        # the access token expired, the refresh token is still valid
+        session = self.client.session
+        token_cache = json.loads(session[views.TOKEN_CACHE_SESSION_KEY])
+        for token in token_cache['AccessToken'].values():
+            token['expires_on'] = str(int(time.time()) - 60)
+        session[views.TOKEN_CACHE_SESSION_KEY] = json.dumps(token_cache)
+        session.save()
+
+        with mock.patch.object(views.tasks, 'schedule') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('sso:refresh'))
+        self.assertRedirects(response, user.employee.get_absolute_url(), fetch_redirect_response=False)
+        schedule.assert_called_once_with(graph.sync_user, user.pk, 'access-token')
+        self.assertEqual(self.count_requests('POST', '/oauth2/v2.0/token'), 2)
+        token_cache = json.loads(self.client.session[views.TOKEN_CACHE_SESSION_KEY])
+        self.assertGreater(int(list(token_cache['AccessToken'].values())[0]['expires_on']), time.time())
+
+    def test_refresh_without_token_cache(self):
+        user = User.objects.create_user('jan.kowalski@example.com')
+        self.client.force_login(user)
+        with mock.patch.object(views.tasks, 'schedule') as schedule:
+            response = self.client.post(reverse('sso:refresh'))
+        self.assertRedirects(response, reverse('sso:redirect'), fetch_redirect_response=False)
+        schedule.assert_not_called()
+
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    # local stand-in for Microsoft Graph, serving the JSON pages and photos (content, ETag) set on the server by path
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path in self.server.pages:
+            self.send_body(json.dumps(self.server.pages[self.path]).encode(), 'application/json')
+            return
+        if self.path in self.server.photos:
+            content, etag = self.server.photos[self.path]
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_body(content, 'image/jpeg', {'ETag': etag})
+            return
+        self.send_response(404)
+        self.end_headers()
+
+    def send_body(self, body, content_type, headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class GraphTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGraphHandler)
+        cls.graph_url = f'http://127.0.0.1:{cls.server.server_port}/v1.0'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(GRAPH_URL=self.graph_url, MEDIA_ROOT=media_root, BACKGROUND_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.pages = {}
+        self.server.photos = {}
+        user = User.objects.create_user('lukasz.wojcik@example.com', first_name='Lukasz', last_name='Wojcik')
+        self.employee = Employee.objects.create(user=user)
+
+
+class GraphSyncTest(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server.pages['/v1.0/me?%24select=givenName%2Csurname'] = {'givenName': 'Łukasz', 'surname': 'Wójcik'}
+        self.server.photos['/v1.0/me/photo/$value'] = (b'photo', '"1"')
+
+    def test_sync_user(self):
+        graph.sync_user(self.employee.pk, 'access-token')
+        employee = Employee.objects.select_related('user').get(pk=self.employee.pk)
+        self.assertEqual(str(employee), 'Łukasz Wójcik')
+        self.assertEqual((employee.avatar_checksum, employee.avatar_etag), (get_checksum(b'photo'), '"1"'))
+
+        # the unchanged photo is not downloaded again
+        self.server.requests = []
+        graph.sync_user(self.employee.pk, 'access-token')
+        self.assertEqual(self.server.requests[-1], ('/v1.0/me/photo/$value', '"1"'))
+        self.assertEqual(Employee.objects.get(pk=self.employee.pk).avatar.name, employee.avatar.name)
+
+    def test_update_avatar_keeps_other_fields(self):
+        employee = Employee.objects.get(pk=self.employee.pk)
+        # changed by the employee form while the photo was downloaded
+        Employee.objects.filter(pk=self.employee.pk).update(nip='1234567890')
+        graph.update_avatar(employee, b'photo', '"1"')
+        employee = Employee.objects.get(pk=self.employee.pk)
+        self.assertEqual((employee.nip, employee.avatar_etag), ('1234567890', '"1"'))
+
+    def test_retry_on_unavailable(self):
+        self.server.failures = 1
+        graph.sync_user(self.employee.pk, 'access-token')
+        self.assertEqual([path for path, _ in self.server.requests[:2]], ['/v1.0/me?%24select=givenName%2Csurname'] * 2)
+        self.assertEqual(User.objects.get(pk=self.employee.pk).first_name, 'Łukasz')
+
+
+class DirectorySyncTest(GraphTestCase):
+    def setUp(self):
+        super().setUp()
+        delta_url = '/v1.0/users/delta?$select=userPrincipalName,givenName,surname'
+        self.server.pages[delta_url] = {
+            'value': [{'id': 'u1', 'userPrincipalName': 'lukasz.wojcik@example.com', 'givenName': 'Łukasz', 'surname': 'Wójcik'}],
+            '@odata.nextLink': self.graph_url + '/users/delta?$skiptoken=2',
+        }
+        self.server.pages['/v1.0/users/delta?$skiptoken=2'] = {
+            'value': [{'id': 'u2', 'userPrincipalName': 'stranger@example.com', 'givenName': 'Anna', 'surname': 'Nowak'}],
+            '@odata.deltaLink': self.graph_url + '/users/delta?$deltatoken=1',
+        }
+        self.server.pages['/v1.0/users/delta?$deltatoken=1'] = {
+            'value': [],
+            '@odata.deltaLink': self.graph_url + '/users/delta?$deltatoken=2',
+        }
+        self.server.photos['/v1.0/users/u1/photo/$value'] = (b'photo', '"1"')
+        patcher = mock.patch.object(views, 'get_application_token', return_value='access-token')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_photos_downloaded_outside_of_transaction(self):
+        get_photos = sync_directory.Command.get_photos
+        depths = []
+
+        def get_photos_recording_transaction(command, *args):
+            depths.append(len(connection.savepoint_ids))
+            return get_photos(command, *args)
+
+        depth = len(connection.savepoint_ids)
+        with mock.patch.object(sync_directory.Command, 'get_photos', get_photos_recording_transaction):
+            call_command('sync_directory', stdout=StringIO())
+        self.assertEqual(depths, [depth, depth])
+        self.assertEqual(Employee.objects.get(pk=self.employee.pk).avatar_checksum, get_checksum(b'photo'))
+
+    def test_sync_directory(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command('sync_directory', stdout=StringIO())
+        employee = Employee.objects.select_related('user').get(pk=self.employee.pk)
+        self.assertEqual(str(employee), 'Łukasz Wójcik')
+        self.assertEqual((employee.avatar_checksum, employee.avatar_etag, employee.avatar_processed), (get_checksum(b'photo'), '"1"', ''))
+        # thumbnails scheduled as with Employee.save
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(User.objects.filter(username='stranger@example.com').exists())
+        self.assertEqual(DirectoryCheckpoint.objects.get().delta_link, self.graph_url + '/users/delta?$deltatoken=1')
+
+        # only changes since the checkpoint are fetched
+        self.server.requests = []
+        call_command('sync_directory', stdout=StringIO())
+        self.assertEqual(self.server.requests, [('/v1.0/users/delta?$deltatoken=1', None)])
+        self.assertEqual(DirectoryCheckpoint.objects.get().delta_link, self.graph_url + '/users/delta?$deltatoken=2')
+
+    def test_delta_page_with_changed_properties_only(self):
+        call_command('sync_directory', '--no-photos', stdout=StringIO())
+        self.assertEqual(Employee.objects.get(pk=self.employee.pk).graph_id, 'u1')
+        # without the user principal name and the unchanged surname
+        self.server.pages['/v1.0/users/delta?$deltatoken=1']['value'] = [{'id': 'u1', 'givenName': 'Lucas'}]
+        call_command('sync_directory', '--no-photos', stdout=StringIO())
+        self.assertEqual(str(Employee.objects.select_related('user').get(pk=self.employee.pk)), 'Lucas Wójcik')
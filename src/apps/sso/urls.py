@@ -7,4 +7,5 @@ urlpatterns = [
     path('redirect/', views.sso_redirect, name='redirect'),
     path('logout/', views.sso_logout, name='logout'),
     path('callback/', views.sso_callback, name='callback'),
+    path('refresh/', views.sso_refresh, name='refresh'),
 ]
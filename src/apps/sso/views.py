@@ -1,4 +1,5 @@
-import hashlib
+import functools
+import threading
 import uuid
 import msal
 import requests
@@ -6,21 +7,88 @@ from django.shortcuts import render, redirect
 from django.urls.base import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import login, logout 
-from django.core.files.base import ContentFile
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.conf import settings
+from django.db import transaction
+from ..base import tasks
+from . import graph
 
-AUTHORITY = "https://login.microsoftonline.com/" + settings.MSAL_TENANT_ID
-ENDPOINT = 'https://graph.microsoft.com/v1.0/users'
+AUTHORITY = settings.MSAL_AUTHORITY
 SCOPE = ['User.Read'] 
-SESSION_TYPE = "filesystem"  # So the token cache will be stored in a server-side session
+TOKEN_CACHE_SESSION_KEY = 'msal_token_cache'  # Token cache of the user, serialized in the server-side session
 
 REDIRECT_AFTER_LOGIN = 'clients:list'
 REDIRECT_LOGIN = 'sso:login'
 CALLBACK_URL = 'sso:callback'
 
+# Shared by the MSAL apps of the process: responses of the authority discovery (OIDC metadata) are cached
+# for a day and connections to the authority are pooled. Neither of them holds tokens.
+_http_cache = {}
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def _get_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            session = requests.Session()
+            session.request = functools.partial(session.request, timeout=settings.MSAL_TIMEOUT)
+            _http_client = session
+    return _http_client
+
 def _build_msal_app(cache=None):
-    return msal.ConfidentialClientApplication(settings.MSAL_CLIENT_ID, settings.MSAL_CLIENT_SECRET, AUTHORITY, token_cache=cache)
+    # The app is bound to the token cache of a single user, so it is built per request.
+    # With the shared http cache and client that doesn't fetch anything.
+    return msal.ConfidentialClientApplication(
+        settings.MSAL_CLIENT_ID, settings.MSAL_CLIENT_SECRET, AUTHORITY, token_cache=cache,
+        http_client=_get_http_client(), http_cache=_http_cache)
+
+def _load_cache(request):
+    cache = msal.SerializableTokenCache()
+    if request.session.get(TOKEN_CACHE_SESSION_KEY):
+        cache.deserialize(request.session[TOKEN_CACHE_SESSION_KEY])
+    return cache
+
+def _save_cache(request, cache):
+    if cache.has_state_changed:
+        request.session[TOKEN_CACHE_SESSION_KEY] = cache.serialize()
+
+def _get_token_from_cache(request, scope=SCOPE):
+    # access token of the logged in user, refreshed silently with the refresh token when expired
+    if not request.session.get(TOKEN_CACHE_SESSION_KEY):
+        return None
+    cache = _load_cache(request)
+    app = _build_msal_app(cache)
+    accounts = app.get_accounts()
+    if not accounts:
+        return None
+    token = app.acquire_token_silent(scope, account=accounts[0])
+    _save_cache(request, cache)
+    return token
+
+def get_application_token():
+    # app-only access token, e.g. for sync_directory (needs the User.Read.All application permission)
+    token = _build_msal_app().acquire_token_for_client(scopes=['https://graph.microsoft.com/.default'])
+    if 'access_token' not in token:
+        raise RuntimeError(token.get('error_description', token.get('error')))
+    return token['access_token']
+
+def _get_user_principal_name(token):
+    # Users are matched on their userPrincipalName, like in sync_directory. The ID token carries it in the upn
+    # optional claim (add it to the ID token in the app registration). preferred_username is mutable and differs
+    # for guests, so without the claim the UPN is read from Graph, the only Graph request of the login.
+    upn = token.get('id_token_claims', {}).get('upn')
+    if upn:
+        return upn
+    try:
+        response = graph.get('/me', token['access_token'], params={'$select': 'userPrincipalName'})
+    except requests.RequestException:
+        return None
+    if response.status_code != requests.codes.ok:
+        return None
+    return response.json().get('userPrincipalName')
 
 def login_page(request):
     if request.user.is_authenticated:
@@ -48,36 +116,49 @@ def sso_callback(request):
         messages.info(request, "Please, try again." )
         return redirect (REDIRECT_LOGIN)
         
-    token = _build_msal_app().acquire_token_by_authorization_code(request.GET['code'], SCOPE, request.build_absolute_uri(reverse(CALLBACK_URL)))
+    cache = _load_cache(request)
+    token = _build_msal_app(cache).acquire_token_by_authorization_code(request.GET['code'], SCOPE, request.build_absolute_uri(reverse(CALLBACK_URL)))
     if "error" in token:
         messages.error(request, token['error'] + ": " + token['error_description'])
         return redirect (REDIRECT_LOGIN)
     if not token:
         return redirect (REDIRECT_LOGIN)
-    headers = {'Authorization': 'Bearer ' + token['access_token']}
-    graph_data = requests.get('https://graph.microsoft.com/v1.0/me/', headers=headers,).json()
+    user_principal_name = _get_user_principal_name(token)
+    if not user_principal_name:
+        messages.error(request, "Your account could not be verified, please try again.")
+        return redirect (REDIRECT_LOGIN)
     try:
-        user = User.objects.get(username=graph_data['userPrincipalName'])
+        user = User.objects.get(username=user_principal_name)
     except User.DoesNotExist:
         messages.error(request, "You do not have permission to access this app.<br>Please, contact administrator." )
         return redirect (REDIRECT_LOGIN)
     if user.is_active:
         login(request, user)
-        user.first_name = graph_data['givenName']
-        user.last_name = graph_data['surname']
-        user.save()
+        _save_cache(request, cache)
         messages.success(request, "You've been logged in")
-        photo_request = requests.get('https://graph.microsoft.com/v1.0/me/photo/$value', headers=headers,)
-        if photo_request.status_code == requests.codes.ok:
-            avatar_checksum = hashlib.md5(photo_request.content).hexdigest()
-            if user.employee.avatar_checksum != avatar_checksum:
-                user.employee.avatar.save('avatar_' + str(user.id) + '.jpg', ContentFile(photo_request.content))    
-                user.employee.avatar_checksum = avatar_checksum
-                user.employee.save()
+        # names and photo are refreshed from Microsoft Graph in the background
+        access_token = token['access_token']
+        transaction.on_commit(lambda: tasks.schedule(graph.sync_user, user.pk, access_token))
     else:
         messages.error(request, "Permission denied, please contact administrator.")
     return redirect (REDIRECT_LOGIN)
 
+@login_required
+@require_POST
+def sso_refresh(request):
+    # refresh names and photo of the logged in user, the access token is renewed silently when it expired
+    token = _get_token_from_cache(request)
+    if not token or 'access_token' not in token:
+        # no usable refresh token in the session (e.g. logged in before token caching), sign in again
+        return redirect('sso:redirect')
+    access_token = token['access_token']
+    user_id = request.user.pk
+    transaction.on_commit(lambda: tasks.schedule(graph.sync_user, user_id, access_token))
+    messages.success(request, "Your name and photo will be refreshed from Microsoft.")
+    if hasattr(request.user, 'employee'):
+        return redirect(request.user.employee.get_absolute_url())
+    return redirect(REDIRECT_AFTER_LOGIN)
+
 def sso_logout(request):
     logout(request)
     messages.success(request, "You've been logged out." )
@@ -1,12 +1,14 @@
-from typing import Dict
+from decimal import Decimal
+from typing import Dict, List
 from django import forms
+from django.db import connection, transaction
 from .models import DRAFT, REJECTED, TimeReport, ProjectRecord, ProjectTime
 from ..projects.models import Project
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, HTML, MultiWidgetField, Div, Button, Row, Column
 from crispy_forms.bootstrap import FormActions
 from django.utils.html import format_html
-from django.forms import modelformset_factory, inlineformset_factory, formset_factory
+from django.forms import modelformset_factory, inlineformset_factory, formset_factory, BaseFormSet
 from dal import autocomplete
 
 class TimeReportCreateForm(forms.Form):
@@ -62,10 +64,12 @@ class TimeEntryForm(forms.Form):
     time_report = ""
     project_record = forms.ModelChoiceField(queryset=ProjectRecord.objects.all(), widget=forms.HiddenInput(), label="", required=False)
 
-    def __init__(self, time_report, *args, **kwargs):
+    def __init__(self, time_report, *args, rates=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.time_report = time_report
+        # RatesInMonth shared by all forms of the formset, see TimeReportUpdate
+        self.rates = rates or time_report.employee.get_rates_in_month(time_report.start_date)
         num_days = time_report.get_days_in_month()
         weekends = time_report.get_weekend_days()
 
@@ -126,7 +130,7 @@ class TimeEntryForm(forms.Form):
             return cleaned_data
         
         project = self.cleaned_data.get('project')
-        self.rate_dictionary = self.time_report.employee.get_dict_of_rates_per_day(self.time_report.start_date, project.is_chargable)
+        self.rate_dictionary = self.rates.get_rates_per_day(project.is_chargable)
 
         currencies = set()
         self.hours_dictionary = {}
@@ -164,73 +168,80 @@ class TimeEntryForm(forms.Form):
 
 
 
-    def save(self):
-        project = self.cleaned_data.get('project')
-        project_record = self.cleaned_data.get('project_record')
-
-        if 'DELETE' in self.changed_data:
-            if project_record is None:
-                return
-            project_record.delete()
-            return
-
-        if project_record is None and project is not None:
-            project_record = ProjectRecord.objects.create(
-                time_report=self.time_report,
-                project=project,
-                comment=self.cleaned_data.get('comment')
-            )
-
-        
-        if 'project' in self.changed_data or 'comment' in self.changed_data:
-            project_record.comment = self.cleaned_data.get('comment')
-            project_record.project = project
-            project_record.save()
-# CREATE or UPDATE all ProjectTime objects for the month and set the hours worked for each day 
-# OR remove all ProjectTime objects and create new ones only for the days that have been filled in ?
-
-# which is better?
-
-        # num_days = project_record.days
-        # time_report_start_date = self.time_report.start_date
-        # time_report_end_date = datetime.date(self.time_report.start_date.year, self.time_report.start_date.month, (num_days - 1))
-        # rates = self.time_report.employee.get_rates_for_period(time_report_start_date, time_report_end_date)
-
-        # rate_dictionary = self.time_report.employee.get_dict_of_rates_per_day(self.time_report.start_date, project.is_chargable)
-        # hours_dictionary = {}
-        # for i in range(1, project_record.days):
-        #     field_name = f"day_{i}"
-        #     hours_worked = self.cleaned_data.get(field_name)
-        #     # if hours_worked is None:
-        #     #     hours_worked = 0
-        #     hours_dictionary[i] = hours_worked
-
-        project_record.set_hours_worked(self.hours_dictionary, self.rate_dictionary)
-        
-        # for rate in rates:
-            # start = max(rate.start_date, time_report_start_date)
-            # end = time_report_end_date
-            # if rate.end_date is not None:
-            #     end = min(rate.end_date, time_report_end_date)
-
-            # for i in range(start.day, end.day + 1):
-            #     if project.is_chargable:
-            #         fee[i] = rate.chargable
-            #         continue
-            #     fee[i] = rate.internal
-        # print (rates)
-        # print (fee)
-        # for i in range(1, num_days):
-        #     field_name = f"day_{i}"
-        #     hours_worked = self.cleaned_data.get(field_name)
-        #     if hours_worked is None:
-        #         hours_worked = 0
-        #     date = datetime.date(self.time_report.start_date.year, self.time_report.start_date.month, i)
-        #     ProjectTime.objects.update_or_create(
-        #             project_record = project_record,
-        #             date=date,
-        #             defaults = {"hours": hours_worked, "rate": fee[i]}
-        #         )   
-
 # TimeEntryFormset = formset_factory(TimeEntryForm, can_delete=True, extra=0, min_num=1)   
 
+class BaseTimeEntryFormSet(BaseFormSet):
+
+    @property
+    def time_report(self):
+        return self.form_kwargs['time_report']
+
+    def get_hours_per_day_lines(self) -> List[Dict[int, int]]:
+        # hours of all project lines that will remain after saving, used to validate the time report before any write
+        return [form.hours_dictionary for form in self.forms if form not in self.deleted_forms and hasattr(form, 'hours_dictionary')]
+
+    def save(self) -> List[ProjectRecord]:
+        # write all changed project lines at once, returns all project records of the time report after saving
+        project_records = []
+        records_to_delete = []
+        new_records = []
+        changed_forms = []
+        for form in self.forms:
+            project = form.cleaned_data.get('project')
+            project_record = form.cleaned_data.get('project_record')
+            if form in self.deleted_forms:
+                if project_record is not None:
+                    records_to_delete.append(project_record)
+                continue
+            if project is None:
+                continue
+            if project_record is None:
+                project_record = ProjectRecord(time_report=self.time_report, project=project)
+                new_records.append(project_record)
+            if form.has_changed():
+                project_record.project = project
+                project_record.comment = form.cleaned_data.get('comment')
+                changed_forms.append((form, project_record))
+            project_records.append(project_record)
+
+        with transaction.atomic():
+            # change of the time report totals, applied with one update instead of re-reading all lines
+            locked_totals = ProjectRecord.objects.filter(
+                pk__in=[project_record.pk for project_record in records_to_delete + project_records if project_record.pk is not None]
+            ).get_locked_totals()
+            no_totals = (0, Decimal(0), Decimal(0))
+            totals_delta = [0, Decimal(0), Decimal(0)]
+            for project_record in records_to_delete:
+                totals_delta = [delta - total for delta, total in zip(totals_delta, locked_totals.get(project_record.pk, no_totals))]
+
+            ProjectRecord.objects.filter(pk__in=[project_record.pk for project_record in records_to_delete]).delete()
+            if connection.features.can_return_rows_from_bulk_insert:
+                ProjectRecord.objects.bulk_create(new_records)
+            else:
+                for project_record in new_records:
+                    project_record.save()
+
+            changed_records = [project_record for form, project_record in changed_forms]
+            project_times = {}
+            for project_time in ProjectTime.objects.filter(project_record__in=changed_records):
+                project_times.setdefault(project_time.project_record_id, []).append(project_time)
+
+            to_create, to_update, to_delete = [], [], []
+            for form, project_record in changed_forms:
+                old_totals = locked_totals.get(project_record.pk, no_totals)
+                created, updated, deleted = project_record.calculate_hours_worked(form.hours_dictionary, form.rate_dictionary, project_times.get(project_record.pk, []))
+                totals_delta = [delta + change for delta, change in zip(totals_delta, project_record.get_totals_delta(old_totals))]
+                to_create += created
+                to_update += updated
+                to_delete += deleted
+            ProjectTime.objects.bulk_create(to_create)
+            ProjectTime.objects.bulk_update(to_update, ['hours', 'rate', 'rate_currency'])
+            ProjectTime.objects.filter(pk__in=[project_time.pk for project_time in to_delete]).delete()
+            ProjectRecord.objects.bulk_update(changed_records, [
+                'project', 'comment', 'total_hours',
+                'total_amount_net', 'total_amount_net_currency',
+                'total_amount_gross', 'total_amount_gross_currency',
+                'hours_grid', 'rate_segments',
+            ])
+            TimeReport.objects.filter(pk=self.time_report.pk).add_to_totals(*totals_delta)
+        return project_records
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from djmoney.money import Money
+from ...models import TimeReport
+
+
+class Command(BaseCommand):
+    help = 'Verify the denormalized time report totals against their project lines and optionally repair them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Overwrite drifted totals with the sums of the project lines.')
+
+    def handle(self, *args, **options):
+        drifted = []
+        for time_report in TimeReport.objects.annotate_line_totals().select_related('employee__user').iterator():
+            line_totals = (time_report.line_total_hours, time_report.line_total_amount_net, time_report.line_total_amount_gross)
+            totals = (time_report.total_hours, time_report.total_amount_net.amount, time_report.total_amount_gross.amount)
+            if line_totals == totals:
+                continue
+            self.stdout.write(f'{time_report}: {totals} != {line_totals}')
+            time_report.total_hours = time_report.line_total_hours
+            time_report.total_amount_net = Money(time_report.line_total_amount_net, time_report.total_amount_net.currency)
+            time_report.total_amount_gross = Money(time_report.line_total_amount_gross, time_report.total_amount_gross.currency)
+            drifted.append(time_report)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All time report totals are correct.'))
+            return
+        if options['repair']:
+            TimeReport.objects.bulk_update(drifted, ['total_hours', 'total_amount_net', 'total_amount_gross'], batch_size=500)
+            self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} time reports.'))
+            return
+        self.stdout.write(self.style.WARNING(f'{len(drifted)} time reports have drifted totals, run with --repair to fix them.'))
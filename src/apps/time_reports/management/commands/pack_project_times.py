@@ -0,0 +1,49 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...models import ProjectRecord, ProjectTime
+
+
+class Command(BaseCommand):
+    help = 'Convert ProjectTime rows of project records to the compact month grid storage (or back with --unpack).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--unpack', action='store_true', help='Convert compact project records back to ProjectTime rows.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        converted = 0
+        while True:
+            with transaction.atomic():
+                if options['unpack']:
+                    count = self.unpack(batch_size)
+                else:
+                    count = self.pack(batch_size)
+            converted += count
+            if count < batch_size:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} project records.'))
+
+    def pack(self, batch_size):
+        project_records = list(ProjectRecord.objects.filter(hours_grid__isnull=True).prefetch_related('projecttime_set')[:batch_size])
+        for project_record in project_records:
+            project_record.pack_hours(project_record.get_hours_per_days(), project_record.get_rates_per_days())
+        ProjectRecord.objects.bulk_update(project_records, ['hours_grid', 'rate_segments'])
+        ProjectTime.objects.filter(project_record__in=project_records).delete()
+        return len(project_records)
+
+    def unpack(self, batch_size):
+        project_records = list(ProjectRecord.objects.filter(hours_grid__isnull=False).select_related('time_report')[:batch_size])
+        project_times = []
+        for project_record in project_records:
+            start_date = project_record.time_report.start_date
+            rates = project_record.get_rates_per_days()
+            for day, hours in project_record.get_hours_per_days().items():
+                date = datetime.date(start_date.year, start_date.month, day)
+                project_times.append(ProjectTime(project_record=project_record, date=date, hours=hours, rate=rates[day]))
+            project_record.hours_grid = None
+            project_record.rate_segments = None
+        ProjectTime.objects.bulk_create(project_times)
+        ProjectRecord.objects.bulk_update(project_records, ['hours_grid', 'rate_segments'])
+        return len(project_records)
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:36
+
+import apps.time_reports.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('time_reports', '0005_timereport_total_amount_gross_and_more'),
+    ]
+
+    operations = [
+        # existing records keep their ProjectTime rows, the default only applies to new records
+        migrations.AddField(
+            model_name='projectrecord',
+            name='hours_grid',
+            field=models.BinaryField(blank=True, max_length=31, null=True),
+        ),
+        migrations.AlterField(
+            model_name='projectrecord',
+            name='hours_grid',
+            field=models.BinaryField(blank=True, default=apps.time_reports.models.get_default_hours_grid, max_length=31, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectrecord',
+            name='rate_segments',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.9 on 2026-10-18 19:36
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # rows the unique constraints below would reject, left by double submitted forms
+    TimeReport = apps.get_model('time_reports', 'TimeReport')
+    ProjectRecord = apps.get_model('time_reports', 'ProjectRecord')
+    ProjectTime = apps.get_model('time_reports', 'ProjectTime')
+
+    # the line totals were computed from one value per day, the one of the last row that was edited
+    duplicates = ProjectTime.objects.values('project_record', 'date').annotate(count=Count('pk'), last=Max('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        ProjectTime.objects.filter(project_record=duplicate['project_record'], date=duplicate['date']).exclude(pk=duplicate['last']).delete()
+
+    # the project lines of later time reports of the same month move to the first one
+    duplicates = TimeReport.objects.values('employee', 'start_date').annotate(count=Count('pk'), first=Min('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        others = TimeReport.objects.filter(employee=duplicate['employee'], start_date=duplicate['start_date']).exclude(pk=duplicate['first'])
+        ProjectRecord.objects.filter(time_report__in=others).update(time_report=duplicate['first'])
+        others.delete()
+        totals = ProjectRecord.objects.filter(time_report=duplicate['first']).aggregate(
+            total_hours=Sum('total_hours'),
+            total_amount_net=Sum('total_amount_net'),
+            total_amount_gross=Sum('total_amount_gross'),
+        )
+        TimeReport.objects.filter(pk=duplicate['first']).update(**{field: total or 0 for field, total in totals.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('time_reports', '0006_projectrecord_compact_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='projectrecord',
+            index=models.Index(fields=['status', 'project'], name='projectrecord_status_project'),
+        ),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='projecttime',
+            constraint=models.UniqueConstraint(fields=('project_record', 'date'), name='unique_project_time_per_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='timereport',
+            constraint=models.UniqueConstraint(fields=('employee', 'start_date'), name='unique_time_report_per_month'),
+        ),
+    ]
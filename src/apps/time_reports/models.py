@@ -1,17 +1,23 @@
 import calendar
 import datetime
-from typing import Any, Dict
+from decimal import Decimal
+from typing import Dict, Iterable, List
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
 from django.urls.base import reverse
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.shortcuts import  redirect
 from djmoney.models.fields import MoneyField, Money
 from PIL import Image
 from ..base.models import unique_slugify
+from ..employees.models import Employee
 from django.core.validators import MaxValueValidator, MinValueValidator 
-from django.db.models import Sum, Q
+from django.db.models import Sum, Q, F
+from django.db.models.functions import Coalesce
 
 DRAFT = 'draft'
 SUBMITTED = 'submitted'
@@ -25,6 +31,49 @@ STATUS_CHOICES = [
     (REJECTED, 'Rejected'),
 ]
 
+# the status of a time report is the first of these statuses found in its project lines
+STATUS_PRIORITY = [REJECTED, DRAFT, SUBMITTED, APPROVED]
+
+MAX_HOURS_PER_DAY = 24
+
+class TimeReportQuerySet(models.QuerySet):
+    # set based versions of TimeReport.submit and TimeReport.update_status, usable for many time reports at once
+
+    def submit(self) -> int:
+        ProjectRecord.objects.filter(time_report__in=self, status__in=[DRAFT, REJECTED]).update(
+            status=models.Case(
+                models.When(total_hours=0, then=models.Value(APPROVED)),
+                default=models.Value(SUBMITTED),
+            )
+        )
+        return self.update(status=SUBMITTED)
+
+    def add_to_totals(self, hours: int, amount_net: Decimal, amount_gross: Decimal) -> int:
+        # apply a change of project line totals on the database side, without reading the other lines
+        return self.update(
+            total_hours=F('total_hours') + hours,
+            total_amount_net=F('total_amount_net') + amount_net,
+            total_amount_gross=F('total_amount_gross') + amount_gross,
+        )
+
+    def annotate_line_totals(self):
+        # totals recomputed from the project lines, to verify the denormalized ones
+        return self.annotate(
+            line_total_hours=Coalesce(Sum('projectrecord__total_hours'), 0),
+            line_total_amount_net=Coalesce(Sum('projectrecord__total_amount_net'), Decimal(0), output_field=models.DecimalField()),
+            line_total_amount_gross=Coalesce(Sum('projectrecord__total_amount_gross'), Decimal(0), output_field=models.DecimalField()),
+        )
+
+    def update_status(self) -> int:
+        # time reports without project lines keep their status
+        project_records = ProjectRecord.objects.filter(time_report=models.OuterRef('pk'))
+        return self.filter(models.Exists(project_records)).update(
+            status=models.Case(
+                *[models.When(models.Exists(project_records.filter(status=status)), then=models.Value(status)) for status in STATUS_PRIORITY[:-1]],
+                default=models.Value(STATUS_PRIORITY[-1]),
+            )
+        )
+
 class TimeReport(models.Model):
     employee = models.ForeignKey('employees.Employee', on_delete=models.CASCADE)
     start_date = models.DateField()
@@ -33,8 +82,25 @@ class TimeReport(models.Model):
     total_amount_net = MoneyField(max_digits=10, decimal_places=2, default_currency='PLN', default=0)
     total_amount_gross = MoneyField(max_digits=10, decimal_places=2, default_currency='PLN', default=0)
 
+    objects = TimeReportQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'start_date'], name='unique_time_report_per_month'),
+        ]
+
     def __str__(self):
         return self.employee.user.first_name + ' ' + self.employee.user.last_name + ' - ' + self.start_date.strftime('%B %Y')
+
+    def save(self, *args, **kwargs):
+        # only a new time report or a changed month affects the empty time reports of the employee
+        if self._state.adding or 'start_date' in (kwargs.get('update_fields') or ['start_date']):
+            Employee.invalidate_empty_time_report(self.employee_id)
+        super(TimeReport, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        Employee.invalidate_empty_time_report(self.employee_id)
+        return super(TimeReport, self).delete(*args, **kwargs)
     
     def get_absolute_url(self): return reverse('time_reports:time-report-detail', kwargs={'pk': self.pk})
     def get_update_url(self): return reverse("time_reports:time-report-update", kwargs={"pk": self.pk})
@@ -55,52 +121,78 @@ class TimeReport(models.Model):
         return weekends
 
     def submit(self) -> None:
+        TimeReport.objects.filter(pk=self.pk).submit()
         self.status = SUBMITTED
-        self.save()
-        for projecrecord in self.projectrecord_set.filter(models.Q(status=DRAFT) | models.Q(status=REJECTED)):
-            projecrecord.status = SUBMITTED
-            if projecrecord.total_hours == 0:
-                projecrecord.status = APPROVED
-            projecrecord.save()
 
     def aggregate_project_lines(self) -> None:
-        self.total_hours = 0
-        self.total_amount_net = Money(0, 'PLN')
-        self.total_amount_gross = Money(0, 'PLN')
-        for projectrecord in self.projectrecord_set.all():
-            self.total_hours += projectrecord.total_hours
-            self.total_amount_net += projectrecord.total_amount_net
-            self.total_amount_gross += projectrecord.total_amount_gross
-        self.save()
+        # full recalculation of the totals, they are normally kept up to date by ProjectRecord (see add_to_totals)
+        totals = self.projectrecord_set.aggregate(
+            total_hours=Sum('total_hours'),
+            total_amount_net=Sum('total_amount_net'),
+            total_amount_gross=Sum('total_amount_gross'),
+        )
+        self.total_hours = totals['total_hours'] or 0
+        self.total_amount_net = Money(totals['total_amount_net'] or 0, 'PLN')
+        self.total_amount_gross = Money(totals['total_amount_gross'] or 0, 'PLN')
+        self.save(update_fields=['total_hours', 'total_amount_net', 'total_amount_gross'])
 
     def update_status(self) -> None:
-        statuses = []
-        for project in self.projectrecord_set.all():
-            statuses.append(project.status)
+        statuses = set(self.projectrecord_set.values_list('status', flat=True).distinct())
 
-        for status in [REJECTED, DRAFT, SUBMITTED, APPROVED]:
+        for status in STATUS_PRIORITY:
             if status in statuses:
                 if self.status != status:
                     self.status = status
-                    self.save()
+                    self.save(update_fields=['status'])
                 return
 
+    def get_hours_per_date(self) -> Dict[datetime.date, int]:
+        # hours of all project lines grouped by day in a single query: one row per day for ProjectTime rows,
+        # one row per project record in compact storage (grouped by its pk, equal grids must not be merged)
+        hours_per_date = {}
+        lines = (
+            self.projectrecord_set
+            .annotate(compact_record=models.Case(models.When(hours_grid__isnull=False, then=F('pk'))))
+            .values('compact_record', 'hours_grid', 'projecttime__date')
+            .annotate(hours=Sum('projecttime__hours'))
+            .order_by()
+            .values_list('hours_grid', 'projecttime__date', 'hours')
+        )
+        for hours_grid, date, hours in lines:
+            if hours_grid is not None:
+                for day, hours in enumerate(bytes(hours_grid), start=1):
+                    if not hours:
+                        continue
+                    date = datetime.date(self.start_date.year, self.start_date.month, day)
+                    hours_per_date[date] = hours_per_date.get(date, 0) + hours
+            elif date is not None:
+                hours_per_date[date] = hours_per_date.get(date, 0) + hours
+        return hours_per_date
+
+    def sum_hours_per_date(self, hours_per_day_lines: Iterable[Dict[int, int]]) -> Dict[datetime.date, int]:
+        # same as get_hours_per_date, but for hours that are not saved yet (e.g. from the formset)
+        hours_per_date = {}
+        for hours_per_day in hours_per_day_lines:
+            for day, hours in hours_per_day.items():
+                if not hours:
+                    continue
+                date = datetime.date(self.start_date.year, self.start_date.month, day)
+                hours_per_date[date] = hours_per_date.get(date, 0) + hours
+        return hours_per_date
 
-    def validate_hours(self, request) -> bool:
-        # sum hours from all projectime recrds and check is any day is over 24h
-        valid_hours = True
-        invalid_dates = []
-        
-        all_project_records = self.projectrecord_set.all()
-        for day in self.days_range():
-            date = datetime.date(self.start_date.year, self.start_date.month, day)
-            total_hours = ProjectTime.objects.filter(Q(project_record__in = all_project_records) & Q(date=date)).aggregate(Sum('hours'))['hours__sum'] or 0
-            if total_hours > 24:
-                valid_hours = False
-                invalid_dates.append(date)
-        if not valid_hours:
+    def get_invalid_dates(self, hours_per_day_lines: Iterable[Dict[int, int]] = None) -> List[datetime.date]:
+        # dates with more than MAX_HOURS_PER_DAY reported, from the database or from the given lines
+        if hours_per_day_lines is None:
+            hours_per_date = self.get_hours_per_date()
+        else:
+            hours_per_date = self.sum_hours_per_date(hours_per_day_lines)
+        return sorted(date for date, hours in hours_per_date.items() if hours > MAX_HOURS_PER_DAY)
+
+    def validate_hours(self, request, hours_per_day_lines: Iterable[Dict[int, int]] = None) -> bool:
+        invalid_dates = self.get_invalid_dates(hours_per_day_lines)
+        if invalid_dates:
             messages.error(request, format_html("Too many hours reported for: <strong>{}</strong>.", ", ".join(str(x) for x in invalid_dates)))
-        return valid_hours       
+        return not invalid_dates
 
     @classmethod
     def get_create_url(cls): return reverse('time_reports:time-report-create')
@@ -108,6 +200,17 @@ class TimeReport(models.Model):
     @classmethod
     def get_list_url(cls): return reverse('time_reports:time-report-list')
 
+def get_default_hours_grid():
+    # new project records use the compact storage (see ProjectRecord.is_compact) when it is enabled in settings
+    return b'' if settings.TIME_REPORTS_COMPACT_STORAGE else None
+
+class ProjectRecordQuerySet(models.QuerySet):
+
+    def get_locked_totals(self) -> Dict[int, tuple]:
+        # totals as stored, locked until the end of the transaction, so the changes added to the time report
+        # totals are computed from what a concurrent save left there and not from a stale instance
+        return {pk: tuple(totals) for pk, *totals in self.select_for_update().values_list('pk', 'total_hours', 'total_amount_net', 'total_amount_gross')}
+
 class ProjectRecord(models.Model):
     time_report = models.ForeignKey('TimeReport', on_delete=models.CASCADE)
     project = models.ForeignKey('projects.Project', on_delete=models.CASCADE)
@@ -116,10 +219,22 @@ class ProjectRecord(models.Model):
     total_hours = models.PositiveSmallIntegerField(default=0)
     total_amount_net = MoneyField(max_digits=10, decimal_places=2, default_currency='PLN', default=0)
     total_amount_gross = MoneyField(max_digits=10, decimal_places=2, default_currency='PLN', default=0)
+    # compact storage: hours of days 1-31 packed one byte per day and [first_day, last_day, amount, currency] rate segments
+    hours_grid = models.BinaryField(max_length=31, blank=True, null=True, default=get_default_hours_grid)
+    rate_segments = models.JSONField(blank=True, null=True)
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        super().__init__(*args, **kwargs)
-        self.days = self.time_report.get_days_in_month()
+    objects = ProjectRecordQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # approvals queue
+            models.Index(fields=['status', 'project'], name='projectrecord_status_project'),
+        ]
+
+    @cached_property
+    def days(self) -> int:
+        # not computed in __init__, it would fetch the time report for every instance of a queryset
+        return self.time_report.get_days_in_month()
 
     def __str__(self):
         return str(self.time_report) + ' - ' + self.project.name
@@ -131,31 +246,69 @@ class ProjectRecord(models.Model):
         days = self.time_report.get_days_in_month()
         for i in range(1, days):
             full_record_dict['day_'+str(i)] = None
-        times = ProjectTime.objects.filter(project_record=self)
-        for time in times:
-            full_record_dict['day_'+str(time.date.day)] = time.hours
+        for day, hours in self.get_hours_per_days().items():
+            full_record_dict['day_'+str(day)] = hours
         full_record_dict['comment'] = self.comment
         return full_record_dict
     
 
+    def is_compact(self) -> bool:
+        # hours are stored in hours_grid and rate_segments instead of ProjectTime rows
+        return self.hours_grid is not None
+
+    def pack_hours(self, hours_per_day: Dict[int, int], rates: Dict[int, MoneyField]) -> None:
+        self.hours_grid = bytes(hours_per_day.get(day) or 0 for day in range(1, 32))
+        rate_segments = []
+        for day in sorted(day for day, hours in hours_per_day.items() if hours):
+            rate = [str(rates[day].amount), str(rates[day].currency)]
+            if rate_segments and rate_segments[-1][2:] == rate:
+                rate_segments[-1][1] = day
+                continue
+            rate_segments.append([day, day] + rate)
+        self.rate_segments = rate_segments
+
     def get_hours_per_days(self) -> dict:
-        project_time_data = self.projecttime_set.all().values('date', 'hours')
-        return {entry['date'].day: entry['hours'] for entry in project_time_data}
+        if self.is_compact():
+            return {day: hours for day, hours in enumerate(bytes(self.hours_grid), start=1) if hours}
+        # uses prefetch_related('projecttime_set') when available
+        return {project_time.date.day: project_time.hours for project_time in self.projecttime_set.all()}
 
-    def set_hours_worked(self, hours_per_day: Dict[int, int], rates: Dict[int, MoneyField]) -> None:
+    def get_rates_per_days(self) -> dict:
+        if self.is_compact():
+            hours_per_day = self.get_hours_per_days()
+            return {
+                day: Money(amount, currency) 
+                for first_day, last_day, amount, currency in self.rate_segments or [] 
+                for day in range(first_day, last_day + 1) if day in hours_per_day
+            }
+        return {project_time.date.day: project_time.rate for project_time in self.projecttime_set.all()}
+
+    def get_totals(self) -> tuple:
+        return (self.total_hours, self.total_amount_net.amount, self.total_amount_gross.amount)
+
+    def get_totals_delta(self, old_totals: tuple) -> tuple:
+        return tuple(new - old for new, old in zip(self.get_totals(), old_totals))
+
+    def calculate_hours_worked(self, hours_per_day: Dict[int, int], rates: Dict[int, MoneyField], project_times: Iterable['ProjectTime']) -> tuple:
+        # diff the existing ProjectTime rows against the new hours (or pack them if compact) and update the totals (without saving)
+        # returns (to_create, to_update, to_delete) lists of ProjectTime objects
         total_amount= Money(0, 'PLN') # TODO Fix hardcoded currency
         total_hours = 0
 
-        self.projecttime_set.all().delete()
+        existing = {project_time.date.day: project_time for project_time in project_times}
+        to_create, to_update = [], []
         for day, hours in hours_per_day.items():
             if hours is None or hours == 0:
                 continue
-            date = datetime.date(self.time_report.start_date.year, self.time_report.start_date.month, day)
-            ProjectTime.objects.update_or_create(
-                    project_record = self,
-                    date=date,
-                    defaults = {"hours": hours, "rate": rates[day]}
-                ) 
+            if not self.is_compact():
+                project_time = existing.pop(day, None)
+                if project_time is None:
+                    date = datetime.date(self.time_report.start_date.year, self.time_report.start_date.month, day)
+                    to_create.append(ProjectTime(project_record=self, date=date, hours=hours, rate=rates[day]))
+                elif project_time.hours != hours or project_time.rate != rates[day]:
+                    project_time.hours = hours
+                    project_time.rate = rates[day]
+                    to_update.append(project_time)
             try:
                 total_amount += hours * rates[day]
             except TypeError:
@@ -163,15 +316,34 @@ class ProjectRecord(models.Model):
                 print(TypeError)
                 pass
             total_hours += hours
-            
-        # self.total_hours = sum(value for value in hours_per_day.values() if value is not None)
+        if self.is_compact():
+            self.pack_hours(hours_per_day, rates)
+        to_delete = list(existing.values())
+
         self.total_hours = total_hours
         self.total_amount_net = total_amount
         # TODO Fix hardcoded tax -> add it as a employee field
         self.total_amount_gross = total_amount * 1.23
-        self.save()
-        
-    
+        return to_create, to_update, to_delete
+
+    def set_hours_worked(self, hours_per_day: Dict[int, int], rates: Dict[int, MoneyField] = None) -> None:
+        if rates is None:
+            rates = self.time_report.employee.get_rates_in_month(self.time_report.start_date).get_rates_per_day(self.project.is_chargable)
+        with transaction.atomic():
+            old_totals = ProjectRecord.objects.filter(pk=self.pk).get_locked_totals().get(self.pk, (0, Decimal(0), Decimal(0)))
+            to_create, to_update, to_delete = self.calculate_hours_worked(hours_per_day, rates, self.projecttime_set.all())
+            ProjectTime.objects.bulk_create(to_create)
+            ProjectTime.objects.bulk_update(to_update, ['hours', 'rate', 'rate_currency'])
+            ProjectTime.objects.filter(pk__in=[project_time.pk for project_time in to_delete]).delete()
+            self.save()
+            TimeReport.objects.filter(pk=self.time_report_id).add_to_totals(*self.get_totals_delta(old_totals))
+
+    def delete(self, *args, **kwargs):
+        # deletes of other origins (e.g. a project) are handled by subtract_deleted_project_record
+        with transaction.atomic():
+            TimeReport.objects.filter(pk=self.time_report_id).add_to_totals(*(-total for total in self.get_totals()))
+            return super().delete(*args, **kwargs)
+
     def set_as_submitted(self) -> None:
         self.status = SUBMITTED
         self.save()
@@ -191,6 +363,23 @@ class ProjectTime(models.Model):
     hours = models.PositiveSmallIntegerField(validators=[MaxValueValidator(24)])
     rate = MoneyField(max_digits=6, decimal_places=2, default_currency='PLN', default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['project_record', 'date'], name='unique_project_time_per_day'),
+        ]
+
     def __str__(self):
         return str(self.project_record) + ' - ' + self.date.strftime('%Y.%m.%d')
     
+
+
+def subtract_deleted_project_record(instance, origin=None, **kwargs):
+    # Project records deleted by a cascade (e.g. of their project) do not go through ProjectRecord.delete.
+    # ProjectRecord.delete and BaseTimeEntryFormSet.save update the totals themselves,
+    # and the totals of a deleted time report do not matter.
+    origin_model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    if origin_model in (ProjectRecord, TimeReport):
+        return
+    TimeReport.objects.filter(pk=instance.time_report_id).add_to_totals(*(-total for total in instance.get_totals()))
+
+post_delete.connect(subtract_deleted_project_record, sender=ProjectRecord)
@@ -1,3 +1,412 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from djmoney.money import Money
+from ..employees.models import Contract, Employee, Rate
+from ..projects.models import Project
+from .models import APPROVED, DRAFT, REJECTED, SUBMITTED, TimeReport, TimeReportQuerySet, ProjectRecord, ProjectTime
 
-# Create your tests here.
+
+class TimeReportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_superuser('jan.kowalski@example.com', first_name='Jan', last_name='Kowalski')
+        cls.employee = Employee.objects.create(user=user)
+        Rate.objects.create(employee=cls.employee, chargable=Money(100, 'PLN'), internal=Money(50, 'PLN'), start_date=datetime.date(2023, 1, 1))
+        cls.time_report = TimeReport.objects.create(employee=cls.employee, start_date=datetime.date(2023, 3, 1))
+
+    def setUp(self):
+        # rates are cached across tests
+        cache.clear()
+        self.client.force_login(self.employee.user)
+
+    def add_project_record(self, name, hours_per_day=None):
+        project = Project.objects.create(name=name)
+        project.managers.add(self.employee)
+        project_record = ProjectRecord.objects.create(time_report=self.time_report, project=project)
+        project_record.set_hours_worked(hours_per_day or {1: 8, 2: 8})
+        return project_record
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+class ProjectRecordQueryTest(TimeReportTestCase):
+    def test_instances_do_not_fetch_time_report(self):
+        for name in ['Alpha', 'Beta', 'Gamma']:
+            self.add_project_record(name)
+        with self.assertNumQueries(1):
+            project_records = list(ProjectRecord.objects.all())
+        with self.assertNumQueries(1):
+            for project_record in ProjectRecord.objects.select_related('time_report'):
+                project_record.days
+
+    def test_time_report_detail_query_count(self):
+        self.add_project_record('Alpha')
+        url = self.time_report.get_absolute_url()
+        queries = self.count_queries(url)
+        for name in ['Beta', 'Gamma', 'Delta']:
+            self.add_project_record(name)
+        self.assertEqual(self.count_queries(url), queries)
+
+
+class HotQueryIndexTest(TimeReportTestCase):
+    def assertUsesIndex(self, queryset, index_name, columns):
+        if connection.vendor == 'postgresql':
+            # tables in tests are tiny, a sequential scan would always win
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            self.assertIn(index_name, queryset.explain())
+            return
+        # SQLite names the indexes of unique constraints sqlite_autoindex_*, so the searched columns are checked as well
+        pattern = r'USING (COVERING )?INDEX (%s|sqlite_autoindex_\w+) \(%s' % (index_name, r'[=<>]+\? AND '.join(columns))
+        self.assertRegex(queryset.explain(), pattern)
+
+    def test_project_time_per_record_and_day(self):
+        project_record = self.add_project_record('Alpha')
+        self.assertUsesIndex(
+            ProjectTime.objects.filter(project_record=project_record, date=datetime.date(2023, 3, 1)),
+            'unique_project_time_per_day', ['project_record_id', 'date'],
+        )
+
+    def test_project_records_by_status_and_project(self):
+        project_record = self.add_project_record('Alpha')
+        self.assertUsesIndex(
+            ProjectRecord.objects.filter(status=SUBMITTED, project=project_record.project),
+            'projectrecord_status_project', ['status', 'project_id'],
+        )
+
+    def test_time_report_per_employee_and_month(self):
+        self.assertUsesIndex(
+            TimeReport.objects.filter(employee=self.employee, start_date=datetime.date(2023, 3, 1)),
+            'unique_time_report_per_month', ['employee_id', 'start_date'],
+        )
+
+    def test_rates_and_contracts_per_employee_and_dates(self):
+        self.assertUsesIndex(
+            Rate.objects.filter(employee=self.employee, start_date__lte=datetime.date(2023, 3, 31)),
+            'rate_employee_dates', ['employee_id', 'start_date'],
+        )
+        self.assertUsesIndex(
+            Contract.objects.filter(employee=self.employee, start_date__lte=datetime.date(2023, 3, 31)),
+            'contract_employee_dates', ['employee_id', 'start_date'],
+        )
+
+
+class InvalidDatesTest(TimeReportTestCase):
+    def test_invalid_dates_from_database(self):
+        self.add_project_record('Alpha', {1: 16, 2: 8, 3: 4})
+        self.add_project_record('Beta', {1: 10, 2: 8})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.time_report.get_invalid_dates(), [datetime.date(2023, 3, 1)])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.time_report.get_hours_per_date(), {
+                datetime.date(2023, 3, 1): 26, datetime.date(2023, 3, 2): 16, datetime.date(2023, 3, 3): 4,
+            })
+
+    def test_invalid_dates_from_lines(self):
+        self.add_project_record('Alpha', {1: 16})
+        lines = [{1: 12, 2: 20, 3: None}, {1: 12, 2: 5, 4: 0}]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.time_report.sum_hours_per_date(lines), {datetime.date(2023, 3, 1): 24, datetime.date(2023, 3, 2): 25})
+            self.assertEqual(self.time_report.get_invalid_dates(lines), [datetime.date(2023, 3, 2)])
+        self.assertEqual(self.time_report.get_invalid_dates([]), [])
+
+
+class SetHoursWorkedTest(TimeReportTestCase):
+    def test_diff_of_project_times(self):
+        project_record = self.add_project_record('Alpha', {1: 8, 2: 8, 3: 8})
+        rates = {day: Money(100, 'PLN') for day in range(1, 32)}
+        rates[2] = Money(120, 'PLN')
+        project_times = {project_time.date.day: project_time for project_time in project_record.projecttime_set.all()}
+        to_create, to_update, to_delete = project_record.calculate_hours_worked({1: 8, 2: 8, 3: 4, 4: 6, 5: 0}, rates, project_times.values())
+        self.assertEqual([project_time.date.day for project_time in to_create], [4])
+        self.assertEqual(sorted(project_time.date.day for project_time in to_update), [2, 3])
+        self.assertEqual(to_delete, [])
+        self.assertEqual(project_record.total_hours, 26)
+        self.assertEqual(project_record.total_amount_net, Money(2760, 'PLN'))
+
+        to_create, to_update, to_delete = project_record.calculate_hours_worked({1: 8}, rates, project_times.values())
+        self.assertEqual((to_create, to_update), ([], []))
+        self.assertEqual(sorted(project_time.date.day for project_time in to_delete), [2, 3])
+
+    def test_resave_statements_are_bounded(self):
+        project_record = self.add_project_record('Alpha', {day: 8 for day in range(1, 21)})
+        project_record = ProjectRecord.objects.select_related('time_report__employee', 'project').get(pk=project_record.pk)
+        rates = self.employee.get_rates_in_month(self.time_report.start_date).get_rates_per_day(True)
+        hours_per_day = {day: 4 for day in range(1, 31)}
+        # locked totals of the record, select, insert and update of project times, save of the record,
+        # totals of the time report and the savepoint, whatever the number of changed days
+        with self.assertNumQueries(8):
+            project_record.set_hours_worked(hours_per_day, rates)
+        self.assertEqual(project_record.projecttime_set.count(), 30)
+        self.time_report.refresh_from_db()
+        self.assertEqual(self.time_report.total_hours, 120)
+        # nothing changed, no statements for project times
+        with self.assertNumQueries(6):
+            project_record.set_hours_worked(hours_per_day, rates)
+        with self.assertNumQueries(8):
+            project_record.set_hours_worked({1: 8}, rates)
+        self.assertEqual(project_record.projecttime_set.count(), 1)
+
+
+class TimeReportUpdateTest(TimeReportTestCase):
+    def get_line(self, project, project_record=None, hours_per_day=None, delete=False):
+        line = {'project': project.pk, 'project_record': project_record.pk if project_record else '', 'comment': ''}
+        for day, hours in (hours_per_day or {}).items():
+            line[f'day_{day}'] = hours
+        if delete:
+            line['DELETE'] = 'on'
+        return line
+
+    def post_lines(self, lines, initial_forms):
+        data = {
+            'ProjectLines-TOTAL_FORMS': len(lines),
+            'ProjectLines-INITIAL_FORMS': initial_forms,
+            'ProjectLines-MIN_NUM_FORMS': 1,
+            'ProjectLines-MAX_NUM_FORMS': 1000,
+            'mode': 'save',
+        }
+        for i, line in enumerate(lines):
+            data.update({f'ProjectLines-{i}-{name}': value for name, value in line.items()})
+        return self.client.post(self.time_report.get_update_url(), data)
+
+    def test_too_many_hours_are_not_saved(self):
+        alpha = self.add_project_record('Alpha', {1: 16})
+        beta = Project.objects.create(name='Beta')
+        response = self.post_lines([
+            self.get_line(alpha.project, alpha, {1: 16}),
+            self.get_line(beta, hours_per_day={1: 10, 2: 8}),
+        ], initial_forms=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Too many hours reported for')
+        self.assertFalse(ProjectRecord.objects.filter(project=beta).exists())
+        self.assertEqual(ProjectTime.objects.count(), 1)
+        self.time_report.refresh_from_db()
+        self.assertEqual(self.time_report.total_hours, 16)
+
+    def test_lines_added_changed_and_deleted(self):
+        alpha = self.add_project_record('Alpha', {1: 8, 2: 8})
+        beta = self.add_project_record('Beta', {1: 8})
+        gamma = Project.objects.create(name='Gamma')
+        response = self.post_lines([
+            self.get_line(alpha.project, alpha, {1: 8, 2: 4, 3: 6}),
+            self.get_line(beta.project, beta, {1: 8}, delete=True),
+            self.get_line(gamma, hours_per_day={1: 8}),
+        ], initial_forms=2)
+        self.assertRedirects(response, self.time_report.get_absolute_url(), fetch_redirect_response=False)
+
+        self.assertFalse(ProjectRecord.objects.filter(pk=beta.pk).exists())
+        hours = {
+            project_record.project.name: project_record.get_hours_per_days()
+            for project_record in self.time_report.projectrecord_set.select_related('project')
+        }
+        self.assertEqual(hours, {'Alpha': {1: 8, 2: 4, 3: 6}, 'Gamma': {1: 8}})
+        time_report = TimeReport.objects.annotate_line_totals().get(pk=self.time_report.pk)
+        self.assertEqual(time_report.total_hours, 26)
+        self.assertEqual(time_report.total_amount_net, Money(2600, 'PLN'))
+        self.assertEqual(
+            (time_report.line_total_hours, time_report.line_total_amount_net, time_report.line_total_amount_gross),
+            (time_report.total_hours, time_report.total_amount_net.amount, time_report.total_amount_gross.amount),
+        )
+
+    def test_formset_saved_in_one_transaction(self):
+        alpha = self.add_project_record('Alpha', {1: 8})
+        beta = Project.objects.create(name='Beta')
+        lines = [self.get_line(alpha.project, alpha, {1: 4}), self.get_line(beta, hours_per_day={2: 8})]
+        # the totals are the last write, failing them rolls back all lines
+        with mock.patch.object(TimeReportQuerySet, 'add_to_totals', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.post_lines(lines, initial_forms=1)
+        self.assertFalse(ProjectRecord.objects.filter(project=beta).exists())
+        self.assertEqual(alpha.get_hours_per_days(), {1: 8})
+
+
+class StatusTest(TimeReportTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_report = TimeReport.objects.create(employee=cls.employee, start_date=datetime.date(2023, 4, 1))
+        cls.empty_report = TimeReport.objects.create(employee=cls.employee, start_date=datetime.date(2023, 5, 1), status=APPROVED)
+
+    def add_line(self, time_report, name, status, hours_per_day):
+        project_record = ProjectRecord.objects.create(time_report=time_report, project=Project.objects.create(name=name), status=status)
+        project_record.set_hours_worked(hours_per_day)
+        return project_record
+
+    def get_statuses(self, *objects):
+        return [type(obj).objects.get(pk=obj.pk).status for obj in objects]
+
+    def test_submit(self):
+        draft = self.add_line(self.time_report, 'Alpha', DRAFT, {1: 8})
+        rejected = self.add_line(self.time_report, 'Beta', REJECTED, {2: 8})
+        empty = self.add_line(self.time_report, 'Gamma', DRAFT, {})
+        approved = self.add_line(self.other_report, 'Delta', APPROVED, {1: 8})
+        other_draft = self.add_line(self.other_report, 'Epsilon', DRAFT, {3: 4})
+        TimeReport.objects.filter(pk__in=[self.time_report.pk, self.other_report.pk]).submit()
+        # lines without hours need no approval
+        self.assertEqual(self.get_statuses(draft, rejected, empty, approved, other_draft), [SUBMITTED, SUBMITTED, APPROVED, APPROVED, SUBMITTED])
+        self.assertEqual(self.get_statuses(self.time_report, self.other_report), [SUBMITTED, SUBMITTED])
+
+    def test_submit_instance(self):
+        draft = self.add_line(self.time_report, 'Alpha', DRAFT, {1: 8})
+        empty = self.add_line(self.time_report, 'Beta', REJECTED, {})
+        other_draft = self.add_line(self.other_report, 'Gamma', DRAFT, {1: 8})
+        self.time_report.submit()
+        self.assertEqual(self.time_report.status, SUBMITTED)
+        self.assertEqual(self.get_statuses(draft, empty, other_draft), [SUBMITTED, APPROVED, DRAFT])
+
+    def test_update_status_priority(self):
+        self.add_line(self.time_report, 'Alpha', APPROVED, {1: 8})
+        self.add_line(self.time_report, 'Beta', SUBMITTED, {1: 8})
+        rejected = self.add_line(self.time_report, 'Gamma', REJECTED, {1: 8})
+        self.add_line(self.other_report, 'Delta', APPROVED, {1: 8})
+        submitted = self.add_line(self.other_report, 'Epsilon', SUBMITTED, {1: 8})
+        TimeReport.objects.all().update_status()
+        # a rejected line wins, then draft, submitted and approved ones
+        self.assertEqual(self.get_statuses(self.time_report, self.other_report, self.empty_report), [REJECTED, SUBMITTED, APPROVED])
+
+        submitted.status = APPROVED
+        submitted.save()
+        rejected.status = SUBMITTED
+        rejected.save()
+        TimeReport.objects.all().update_status()
+        self.assertEqual(self.get_statuses(self.time_report, self.other_report, self.empty_report), [SUBMITTED, APPROVED, APPROVED])
+
+    def test_update_status_instance(self):
+        self.add_line(self.time_report, 'Alpha', APPROVED, {1: 8})
+        self.add_line(self.time_report, 'Beta', DRAFT, {1: 8})
+        self.add_line(self.time_report, 'Gamma', SUBMITTED, {1: 8})
+        self.time_report.update_status()
+        self.assertEqual(self.get_statuses(self.time_report), [DRAFT])
+        self.add_line(self.time_report, 'Delta', REJECTED, {1: 8})
+        self.time_report.update_status()
+        self.assertEqual(self.get_statuses(self.time_report), [REJECTED])
+        # no project lines, the status is kept
+        self.empty_report.update_status()
+        self.assertEqual(self.get_statuses(self.empty_report), [APPROVED])
+
+
+class TotalsTest(TimeReportTestCase):
+    def assertTotalsMatchLines(self, total_hours):
+        time_report = TimeReport.objects.annotate_line_totals().get(pk=self.time_report.pk)
+        self.assertEqual(time_report.total_hours, total_hours)
+        self.assertEqual(
+            (time_report.total_hours, time_report.total_amount_net.amount, time_report.total_amount_gross.amount),
+            (time_report.line_total_hours, time_report.line_total_amount_net, time_report.line_total_amount_gross),
+        )
+
+    def test_incremental_totals(self):
+        alpha = self.add_project_record('Alpha', {1: 8, 2: 8})
+        beta = self.add_project_record('Beta', {3: 6})
+        self.assertTotalsMatchLines(22)
+        alpha.set_hours_worked({1: 4, 2: 8, 4: 8})
+        self.assertTotalsMatchLines(26)
+        beta.delete()
+        self.assertTotalsMatchLines(20)
+
+    def test_stale_instance_uses_stored_totals(self):
+        alpha = self.add_project_record('Alpha', {1: 8})
+        stale = ProjectRecord.objects.get(pk=alpha.pk)
+        alpha.set_hours_worked({1: 8, 2: 8})
+        stale.set_hours_worked({1: 4})
+        self.assertTotalsMatchLines(4)
+
+    def test_project_delete_cascade(self):
+        alpha = self.add_project_record('Alpha', {1: 8})
+        self.add_project_record('Beta', {2: 6})
+        alpha.project.delete()
+        self.assertTotalsMatchLines(6)
+        Project.objects.all().delete()
+        self.assertTotalsMatchLines(0)
+
+    def test_check_and_repair_command(self):
+        self.add_project_record('Alpha', {1: 8, 2: 8})
+        TimeReport.objects.filter(pk=self.time_report.pk).add_to_totals(3, Decimal(10), Decimal(20))
+        out = StringIO()
+        call_command('check_time_report_totals', stdout=out)
+        self.assertIn('1 time reports have drifted totals', out.getvalue())
+        self.assertEqual(TimeReport.objects.get(pk=self.time_report.pk).total_hours, 19)
+
+        out = StringIO()
+        call_command('check_time_report_totals', '--repair', stdout=out)
+        self.assertIn('Repaired 1 time reports', out.getvalue())
+        self.assertTotalsMatchLines(16)
+        out = StringIO()
+        call_command('check_time_report_totals', stdout=out)
+        self.assertIn('All time report totals are correct', out.getvalue())
+
+
+class CompactStorageTest(TimeReportTestCase):
+    def setUp(self):
+        super().setUp()
+        # the rate changes in the middle of the month
+        Rate.objects.filter(employee=self.employee).update(end_date=datetime.date(2023, 3, 15))
+        Rate.objects.create(employee=self.employee, chargable=Money(120, 'PLN'), internal=Money(60, 'PLN'), start_date=datetime.date(2023, 3, 16))
+        cache.clear()
+
+    def get_lines(self):
+        return {
+            project_record.project.name: (project_record.is_compact(), project_record.get_hours_per_days(), project_record.get_rates_per_days())
+            for project_record in self.time_report.projectrecord_set.select_related('project').prefetch_related('projecttime_set')
+        }
+
+    def test_pack_and_unpack(self):
+        hours_per_day = {1: 8, 2: 8, 15: 4, 16: 6, 31: 2}
+        rates = {day: Money(100 if day <= 15 else 120, 'PLN') for day in hours_per_day}
+        project_record = self.add_project_record('Alpha', hours_per_day)
+        self.add_project_record('Beta', {3: 8})
+        self.assertEqual(project_record.get_rates_per_days(), rates)
+        lines = self.get_lines()
+
+        call_command('pack_project_times', stdout=StringIO())
+        self.assertFalse(ProjectTime.objects.exists())
+        project_record.refresh_from_db()
+        self.assertEqual(project_record.rate_segments, [[1, 15, '100.00', 'PLN'], [16, 31, '120.00', 'PLN']])
+        self.assertEqual(self.get_lines(), {name: (True, hours, rates) for name, (_, hours, rates) in lines.items()})
+
+        call_command('pack_project_times', '--unpack', stdout=StringIO())
+        self.assertEqual(self.get_lines(), lines)
+        self.assertEqual(ProjectTime.objects.count(), 6)
+
+    def test_hours_per_date_of_mixed_lines(self):
+        self.add_project_record('Alpha', {1: 8, 2: 4})
+        with override_settings(TIME_REPORTS_COMPACT_STORAGE=True):
+            compact = self.add_project_record('Beta', {1: 8, 20: 6})
+            self.add_project_record('Gamma', {1: 8, 20: 6})
+        self.assertTrue(compact.is_compact())
+        self.assertEqual(ProjectTime.objects.count(), 2)
+        self.assertEqual(self.time_report.get_hours_per_date(), {
+            datetime.date(2023, 3, 1): 24, datetime.date(2023, 3, 2): 4, datetime.date(2023, 3, 20): 12,
+        })
+        self.assertEqual(self.time_report.get_invalid_dates(), [])
+
+    @override_settings(TIME_REPORTS_COMPACT_STORAGE=True)
+    def test_formset_save(self):
+        alpha = self.add_project_record('Alpha', {1: 8})
+        self.assertTrue(alpha.is_compact())
+        data = {
+            'ProjectLines-TOTAL_FORMS': 2, 'ProjectLines-INITIAL_FORMS': 1,
+            'ProjectLines-MIN_NUM_FORMS': 1, 'ProjectLines-MAX_NUM_FORMS': 1000, 'mode': 'save',
+            'ProjectLines-0-project': alpha.project.pk, 'ProjectLines-0-project_record': alpha.pk,
+            'ProjectLines-0-day_1': 4, 'ProjectLines-0-day_20': 8,
+            'ProjectLines-1-project': Project.objects.create(name='Beta').pk, 'ProjectLines-1-day_2': 8,
+        }
+        self.client.post(self.time_report.get_update_url(), data)
+        self.assertFalse(ProjectTime.objects.exists())
+        self.assertEqual(self.get_lines(), {
+            'Alpha': (True, {1: 4, 20: 8}, {1: Money(100, 'PLN'), 20: Money(120, 'PLN')}),
+            'Beta': (True, {2: 8}, {2: Money(100, 'PLN')}),
+        })
+        time_report = TimeReport.objects.get(pk=self.time_report.pk)
+        self.assertEqual((time_report.total_hours, time_report.total_amount_net), (20, Money(2160, 'PLN')))
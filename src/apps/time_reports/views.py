@@ -3,12 +3,13 @@ from django import http
 from django.forms import formset_factory
 from django.http.response import HttpResponse
 from django.urls import reverse
+from django.db import transaction
 from .models import TimeReport, ProjectRecord
 from django.views import generic, View
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 # from .forms import TimeReportCreateForm, ProjectRecordForm, ProjectRecordFormSet, ProjectLineForm, ProjectLineFormset
-from .forms import TimeReportCreateForm, TimeEntryForm
+from .forms import TimeReportCreateForm, TimeEntryForm, BaseTimeEntryFormSet
 from django.contrib import messages
 from django.utils.html import format_html
 from django.shortcuts import  get_object_or_404, redirect, render
@@ -59,10 +60,15 @@ class TimeReportDetail(PermissionRequiredMixin, generic.DetailView):
     context_object_name = 'time_report'
     permission_required = 'time_reports.view_time_report'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['project_records'] = self.object.projectrecord_set.select_related('project').prefetch_related('projecttime_set')
+        return context
+
 class TimeReportUpdate(PermissionRequiredMixin, SuccessMessageMixin, View):
     template_name = 'time_reports/time_report_update_form.html'
     permission_required = 'time_reports.add_time_report'
-    TimeEntryFormset = formset_factory(TimeEntryForm, can_delete=True, extra=0, min_num=1)   
+    TimeEntryFormset = formset_factory(TimeEntryForm, formset=BaseTimeEntryFormSet, can_delete=True, extra=0, min_num=1)   
     time_report = None        
     formset = None
     days_in_time_report = None
@@ -73,7 +79,7 @@ class TimeReportUpdate(PermissionRequiredMixin, SuccessMessageMixin, View):
         project_records = ProjectRecord.objects.filter(time_report=self.time_report)
         for project in project_records:
             initial.append(project.get_full_record())
-        self.formset = self.TimeEntryFormset(request.POST or None, initial=initial, form_kwargs={'time_report': self.time_report}, prefix="ProjectLines")
+        self.formset = self.TimeEntryFormset(request.POST or None, initial=initial, form_kwargs={'time_report': self.time_report, 'rates': self.time_report.employee.get_rates_in_month(self.time_report.start_date)}, prefix="ProjectLines")
         self.days_in_time_report = self.time_report.get_days_in_month()
         self.context = {
             'formset': self.formset, 
@@ -103,66 +109,11 @@ class TimeReportUpdate(PermissionRequiredMixin, SuccessMessageMixin, View):
         if not self.formset.is_valid():
             messages.error(request, format_html("Time report <strong>{}</strong> not updated.",  self.time_report))
             return render(request, 'time_reports/time_report_update_form.html', context=self.context)
-        for form in self.formset:
-            if form.has_changed():
-                form.save()
-        self.time_report.aggregate_project_lines()
-        if not self.time_report.validate_hours(request):
+        if not self.time_report.validate_hours(request, self.formset.get_hours_per_day_lines()):
             return render(request, 'time_reports/time_report_update_form.html', context=self.context)
-        if self.formset.data["mode"] == "submit":
-            self.time_report.submit() 
+        with transaction.atomic():
+            self.formset.save()
+            if self.formset.data["mode"] == "submit":
+                self.time_report.submit() 
         messages.success(request, format_html("Time report <strong>{}</strong> updated.",  self.time_report))
         return redirect(self.time_report.get_absolute_url())
-
-class ApprovalsList(PermissionRequiredMixin, SuccessMessageMixin, generic.ListView):
-    template_name = 'time_reports/approvals_list.html'
-    context_object_name = 'approvals'
-    permission_required = 'time_reports.view_time_report' # TODO: change permisssion to appropriate one
-
-    def get_queryset(self):
-        current_user = self.request.user.employee
-        context = {}
-        context['time_reports'] = ProjectRecord.objects.filter(
-            status='submitted', #TODO: fix hardcoding
-            project__managers=current_user #TODO: fix relation name
-        ).order_by('project__name').order_by('time_report__employee__name').order_by('time_report__start_date')
-        # print (submitted_ProjectRecord)
-        return context
-    
-class ApprovalDecision(PermissionRequiredMixin, SuccessMessageMixin, View):
-    approval_item = None
-    approval_item_type = None
-    approval_list_url = None
-
-    def has_permission(self) -> bool:
-        if self.request.user.employee in self.approval_item.project.managers.all():
-            return True
-        return False
-
-    def setup(self, request, *args, **kwargs):
-        self.approval_list_url = reverse('time_reports:approval-list')
-        return super().setup(request, *args, **kwargs)
-
-    def dispatch(self, request: http.HttpRequest, *args: Any, **kwargs: Any):    
-        if kwargs['type'] not in ['project']:
-            messages.error(request, format_html("Type <strong>{}</strong> not supported.", kwargs['type']))
-            return redirect(self.approval_list_url)
-        if kwargs['type'] == 'project':
-            self.approval_item = get_object_or_404(ProjectRecord, id=kwargs['pk'])
-            self.approval_item_type = 'Project'
-        if self.approval_item.status != 'submitted':
-            messages.error(request, format_html("{} is not submitted.", self.approval_item_type))
-            return redirect(self.approval_list_url)
-        return super().dispatch(request, *args, **kwargs)
-
-    def get(self, request, *args, **kwargs):
-        if kwargs['decision'] == 'approve':
-            messages.success(request, format_html("{} approved.", self.approval_item_type))
-            self.approval_item.status = 'approved'
-        if kwargs['decision'] == 'reject':
-            messages.error(request, format_html("{} rejected.", self.approval_item_type))
-            self.approval_item.status = 'rejected'
-        self.approval_item.save()
-        self.approval_item.time_report.update_status()
-        return redirect(self.approval_list_url)
-
@@ -18,6 +18,12 @@ SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
 MSAL_CLIENT_SECRET = os.environ.get('MSAL_CLIENT_SECRET')
 MSAL_CLIENT_ID = os.environ.get('MSAL_CLIENT_ID')
 MSAL_TENANT_ID = os.environ.get('MSAL_TENANT_ID')
+MSAL_AUTHORITY = os.environ.get('MSAL_AUTHORITY', f'https://login.microsoftonline.com/{MSAL_TENANT_ID}')
+# Seconds to wait for the authority (login.microsoftonline.com)
+MSAL_TIMEOUT = int(os.environ.get('MSAL_TIMEOUT', 10))
+GRAPH_URL = os.environ.get('GRAPH_URL', 'https://graph.microsoft.com/v1.0')
+# Seconds to wait for a Microsoft Graph response, the calls run in the background
+GRAPH_TIMEOUT = int(os.environ.get('GRAPH_TIMEOUT', 10))
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -86,12 +92,71 @@ WSGI_APPLICATION = 'projectify.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'projectify'),
+            'USER': os.environ.get('DATABASE_USER', 'projectify'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            # Keep connections open between requests and check them before reuse
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            # Behind a transaction-pooling PgBouncer server-side cursors don't survive between transactions
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DATABASE_POOLED', 'False') == 'True',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5)),
+            },
+            'TEST': {
+                'NAME': os.environ.get('DATABASE_TEST_NAME', 'test_projectify'),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Wait for concurrent writers instead of failing with "database is locked"
+            'OPTIONS': {
+                'timeout': 20,
+            },
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# locmem is per process, use file or redis (needs the redis package) to share the cache between workers
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_LOCATIONS = {
+    'locmem': 'projectify',
+    'file': BASE_DIR / 'cache',
+    'redis': 'redis://localhost:6379/0',
+}
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', CACHE_LOCATIONS[CACHE_BACKEND]),
+        'KEY_PREFIX': 'projectify',
     }
 }
+if CACHE_BACKEND != 'redis':
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
+# permissions cached across requests (see base/backends.py), only with a cache shared by all processes,
+# which all see the invalidations
+PERMISSIONS_CACHE = CACHE_BACKEND in ('file', 'redis')
 
 
 # Password validation
@@ -134,6 +199,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Threads for background work (avatar resizing, Microsoft Graph sync), 0 runs it inline
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -150,6 +218,12 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 LOGIN_URL = "sso:login"
 
+AUTHENTICATION_BACKENDS = ['apps.base.backends.CachedPermissionsBackend']
+
 CURRENCIES = ('USD', 'EUR', 'PLN', 'RON')
 
+# Store hours of new project records as a packed month grid instead of ProjectTime rows,
+# existing records can be converted with `manage.py pack_project_times`
+TIME_REPORTS_COMPACT_STORAGE = os.environ.get('TIME_REPORTS_COMPACT_STORAGE', 'False') == 'True'
+
 # USE_L10N = True
\ No newline at end of file
@@ -12,6 +12,7 @@ urlpatterns = [
     path('projects/', include('apps.projects.urls')),
     path('time-reports/', include('apps.time_reports.urls')),
     path('approvals/', include('apps.approvals.urls')),
+    path('', include('apps.base.urls')),
 ]
 
 if settings.DEBUG: